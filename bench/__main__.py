@@ -0,0 +1,50 @@
+import argparse
+import json
+import platform
+import resource
+import sys
+import time
+
+from bench import load, micro
+
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes everywhere else.
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Benchmark dashboard.py.")
+    parser.add_argument("--only", choices=["micro", "load"], help="run a single part")
+    parser.add_argument("--sizes", type=int, nargs="+", default=micro.SIZES, help="CSV rows per section for microbenchmarks")
+    parser.add_argument("--min-seconds", type=float, default=0.5, help="minimum time per microbenchmark")
+    parser.add_argument("--duration", type=float, default=10.0, help="load test duration in seconds")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent load test clients")
+    parser.add_argument("--workers", type=int, help="server worker threads (default: WORKERS)")
+    parser.add_argument("--rows", type=int, default=50, help="CSV rows per section for upload requests")
+    parser.add_argument("--out", help="write JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+    if args.only in {None, "micro"}:
+        report["micro"] = micro.run(args.sizes, args.min_seconds)
+        report["micro_peak_rss_kb"] = peak_rss_kb()
+    if args.only in {None, "load"}:
+        report["load"] = load.run(args.duration, args.concurrency, args.rows, args.workers)
+    report["peak_rss_kb"] = peak_rss_kb()
+
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# Card rendering throughput: the compiled Template path in dashboard.py
+# against the original per-item f-string renderer kept below for reference.
+# Run from the repository root: python -m bench.cards
+import argparse
+import html
+import json
+import time
+from urllib.parse import quote
+
+import dashboard
+from bench.synth import make_items
+
+
+def legacy_card_html(item):
+    name = item.get("name") or item.get("sku") or "Item"
+    includes = item.get("includes") or ""
+    img = item.get("img") or ""
+    now = dashboard.extract_money(item.get("price", ""))
+    reg = dashboard.extract_money(item.get("reg", ""))
+    qty = dashboard.extract_qty(item.get("qty", ""))
+    badge = item.get("badge", "").strip()
+    search = quote(name)
+
+    data_attrs = []
+    if reg:
+        data_attrs.append(f'data-reg="{reg}"')
+    if now:
+        data_attrs.append(f'data-now="{now}"')
+    if qty:
+        data_attrs.append(f'data-qty="{html.escape(str(qty))}"')
+    if badge:
+        data_attrs.append(f'data-badge="{html.escape(badge)}"')
+    data_attrs_str = " ".join(data_attrs)
+
+    # Badge and price text are spelled out here rather than taken from
+    # dashboard.card_display, so the identity check in main() covers them.
+    now_amount = int(now) if now else 0
+    reg_amount = int(reg) if reg else 0
+    off = reg_amount - now_amount if reg_amount > 0 and now_amount > 0 and reg_amount > now_amount else 0
+    badge_text = html.escape(badge) if badge else ("Last Ones" if qty == "1" else "Clearance")
+    off_text = f"${off:,} OFF" if off else ""
+    off_display = "inline-block" if off else "none"
+    now_text = f"Now ${now_amount:,}" if now_amount > 0 else ""
+    reg_text = f"${reg_amount:,}" if reg_amount > 0 else ""
+    includes_text = f"Includes: {html.escape(includes)}" if includes else ""
+    qty_text = f"Qty Left: {html.escape(str(qty))}" if qty else ""
+
+    return f"""
+<table class="ms-card" {data_attrs_str} role="presentation" width="100%" cellspacing="0" cellpadding="0" style="border: 1px solid #e5e7eb; border-radius: 12px; overflow: hidden;">
+  <tbody>
+    <tr>
+      <td style="padding: 0;">
+        <div style="position: relative;">
+          <a href="/Product/SiteSearch?search={search}" style="text-decoration: none; color: inherit;">
+            <img src="{html.escape(img)}" alt="{html.escape(name)}" loading="lazy" decoding="async" style="width: 100%; height: auto; display: block; border: 0;" />
+          </a>
+          <div class="ms-badge" style="position: absolute; top: 10px; left: 10px; background: #111827; color: #fff; font-weight: 900; border-radius: 999px; padding: 6px 10px; font-size: 12px; letter-spacing: .04em;">{badge_text}</div>
+          <div class="ms-offbadge" style="position: absolute; top: 10px; right: 10px; background: #b45309; color: #fff; font-weight: 900; border-radius: 999px; padding: 8px 14px; font-size: 14px; letter-spacing: .04em; box-shadow: 0 6px 14px rgba(0,0,0,.18); display: {off_display};">{off_text}</div>
+          <div style="position: absolute; left: 0; bottom: 0; background: #ffffff; color: #111827; font-weight: 900; font-size: 14px; padding: 6px 10px; border-top-right-radius: 8px;">{html.escape(name)}</div>
+        </div>
+      </td>
+    </tr>
+    <tr>
+      <td style="padding: 10px 12px 14px;">
+        <table role="presentation" width="100%" cellspacing="0" cellpadding="0">
+          <tbody>
+            <tr>
+              <td valign="top" style="padding-right: 10px;">
+                <div style="color: #6b7280; font-size: 12px;">{includes_text}</div>
+                <div style="margin-top: 8px; display: flex; align-items: center; gap: 10px; flex-wrap: wrap;">
+                  <div class="ms-nowline" style="font-weight: 900; font-size: 13px; color: #111827;">{now_text}</div>
+                  <div style="color: #374151; font-size: 13px;">Was <span class="ms-regline" style="text-decoration: line-through;">{reg_text}</span></div>
+                </div>
+              </td>
+              <td valign="top" style="text-align: right;">
+                <div style="color: #6b7280; font-size: 12px;">{qty_text}</div>
+                <a href="/Home/Locations" style="display: inline-block; margin-top: 8px; padding: 8px 12px; border-radius: 8px; background: #f3f4f6; color: #111827; text-decoration: none; font-weight: 800; font-size: 12px;">Check Store Stock</a>
+              </td>
+            </tr>
+          </tbody>
+        </table>
+      </td>
+    </tr>
+  </tbody>
+</table>
+""".strip()
+
+
+def legacy_build_cards_table(items):
+    rows = []
+    for i in range(0, len(items), 2):
+        left = legacy_card_html(items[i])
+        right = legacy_card_html(items[i + 1]) if i + 1 < len(items) else ""
+        right_cell = right or ""
+        rows.append(f"""
+<tr>
+  <td width="50%" valign="top" style="padding: 8px;">{left}</td>
+  <td width="50%" valign="top" style="padding: 8px;">{right_cell}</td>
+</tr>
+""".strip())
+    tbody = "\n".join(rows)
+    return f"""
+<table role="presentation" width="100%" cellspacing="0" cellpadding="0" style="margin: 6px 0;">
+  <tbody>
+{tbody}
+  </tbody>
+</table>
+""".strip()
+
+
+def measure(fn, items, min_seconds):
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        fn(items)
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return runs * len(items) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark card rendering throughput.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--min-seconds", type=float, default=1.0)
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        items = make_items(size)
+        if legacy_build_cards_table(items) != dashboard.build_cards_table(items):
+            raise SystemExit(f"output mismatch at {size} items")
+        legacy = measure(legacy_build_cards_table, items, args.min_seconds)
+        compiled = measure(dashboard.build_cards_table, items, args.min_seconds)
+        results.append({
+            "items": size,
+            "legacy_cards_per_sec": round(legacy),
+            "template_cards_per_sec": round(compiled),
+            "speedup": round(compiled / legacy, 2),
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# CSV parsing throughput and retained memory: the projecting parser behind
+# parse_csv_sections against the original full-row parser it replaced.
+# --plain uses an export with no quoted cells, which takes the str.split path.
+# Run from the repository root: python -m bench.csvparse
+import argparse
+import io
+import json
+import time
+import tracemalloc
+
+import dashboard
+from bench.synth import SECTION_HEADERS, make_csv
+
+
+def legacy_parse(csv_text):
+    return dashboard.collect_sections(dashboard.iter_csv_sections_legacy(io.StringIO(csv_text)))
+
+
+def retained_kb(fn, csv_text):
+    tracemalloc.start()
+    result = fn(csv_text)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size // 1024
+
+
+def best_seconds(fn, csv_text, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(csv_text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CSV section parsing.")
+    parser.add_argument("--rows", type=int, default=100000, help="total item rows across all sections")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--plain", action="store_true", help="no quoted cells, so rows skip csv.reader")
+    args = parser.parse_args()
+
+    csv_text = make_csv(max(1, args.rows // len(SECTION_HEADERS)), plain=args.plain)
+    legacy = legacy_parse(csv_text)
+    fast = dashboard.parse_csv_sections(csv_text)
+    if any(len(legacy[key]) != len(fast[key]) or any(a != b for a, b in zip(fast[key], legacy[key])) for key in legacy):
+        raise SystemExit("output mismatch")
+
+    results = {"rows": sum(len(items) for items in fast.values()), "bytes": len(csv_text)}
+    for name, fn in (("legacy", legacy_parse), ("projected", dashboard.parse_csv_sections)):
+        seconds = best_seconds(fn, csv_text, args.repeat)
+        results[name] = {
+            "best_ms": round(seconds * 1000, 1),
+            "rows_per_sec": round(results["rows"] / seconds),
+            "retained_kb": retained_kb(fn, csv_text),
+        }
+    results["speedup"] = round(results["projected"]["rows_per_sec"] / results["legacy"]["rows_per_sec"], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
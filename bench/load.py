@@ -0,0 +1,139 @@
+import http.client
+import json
+import random
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import dashboard
+from bench.synth import make_csv
+
+PAGES = ["living room", "bedrooms", "dining-room", "recliners", "manager-specials"]
+ROUTE_WEIGHTS = {
+    "/": 10,
+    "/render": 40,
+    "/raw": 20,
+    "/save": 5,
+    "/upload-csv": 2,
+    "/upload-csv-stream": 2,
+}
+
+
+class QuietHandler(dashboard.Handler):
+    def log_message(self, format, *args):
+        pass
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+    return round(samples[index] * 1000, 3)
+
+
+def build_request(route, rng, csv_body):
+    page = rng.choice(PAGES)
+    query = "?file=" + page.replace(" ", "%20")
+    if route == "/":
+        return "GET", "/", None, {}
+    if route in {"/render", "/raw"}:
+        return "GET", route + query, None, {"Accept-Encoding": "gzip"}
+    if route == "/save":
+        body = json.dumps({"file": page, "html": "<p>benchmark</p>"}).encode("utf-8")
+        return "POST", route, body, {"Content-Type": "application/json"}
+    if route == "/upload-csv":
+        body = json.dumps({"csv": csv_body}).encode("utf-8")
+        return "POST", route, body, {"Content-Type": "application/json"}
+    return "POST", route, csv_body.encode("utf-8"), {"Content-Type": "text/csv"}
+
+
+def client(port, deadline, seed, csv_bodies, samples, errors, lock):
+    rng = random.Random(seed)
+    routes = list(ROUTE_WEIGHTS)
+    weights = list(ROUTE_WEIGHTS.values())
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    local = {route: [] for route in routes}
+    local_errors = 0
+    while time.perf_counter() < deadline:
+        route = rng.choices(routes, weights)[0]
+        method, url, body, headers = build_request(route, rng, rng.choice(csv_bodies))
+        t0 = time.perf_counter()
+        try:
+            conn.request(method, url, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 400:
+                local_errors += 1
+            if response.getheader("Connection", "").lower() == "close":
+                conn.close()
+        except (OSError, http.client.HTTPException):
+            local_errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            continue
+        local[route].append(time.perf_counter() - t0)
+    conn.close()
+    with lock:
+        for route, values in local.items():
+            samples[route].extend(values)
+        errors[0] += local_errors
+
+
+def run(duration=10.0, concurrency=16, rows_per_section=50, workers=None):
+    workdir = Path(tempfile.mkdtemp(prefix="fdwebsite-bench-"))
+    for page in PAGES:
+        source = dashboard.ROOT / page
+        if source.is_file():
+            shutil.copy2(source, workdir / page)
+    saved_root = dashboard.ROOT
+    dashboard.set_root(workdir)
+    server = dashboard.PooledHTTPServer(("127.0.0.1", 0), QuietHandler, workers=workers or dashboard.WORKERS)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    port = server.server_address[1]
+    # Alternate between two exports so incremental uploads still do work.
+    csv_bodies = [make_csv(rows_per_section, seed=0), make_csv(rows_per_section, seed=1)]
+    samples = {route: [] for route in ROUTE_WEIGHTS}
+    errors = [0]
+    lock = threading.Lock()
+    try:
+        started = time.perf_counter()
+        deadline = started + duration
+        clients = [
+            threading.Thread(target=client, args=(port, deadline, i, csv_bodies, samples, errors, lock))
+            for i in range(concurrency)
+        ]
+        for t in clients:
+            t.start()
+        for t in clients:
+            t.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        server.shutdown()
+        server.server_close()
+        dashboard.set_root(saved_root)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    routes = {}
+    total = 0
+    for route, values in samples.items():
+        values.sort()
+        total += len(values)
+        routes[route] = {
+            "requests": len(values),
+            "req_per_sec": round(len(values) / elapsed, 1),
+            "p50_ms": percentile(values, 50),
+            "p95_ms": percentile(values, 95),
+            "p99_ms": percentile(values, 99),
+        }
+    return {
+        "duration_s": round(elapsed, 2),
+        "concurrency": concurrency,
+        "workers": workers or dashboard.WORKERS,
+        "requests": total,
+        "errors": errors[0],
+        "req_per_sec": round(total / elapsed, 1),
+        "routes": routes,
+    }
@@ -0,0 +1,44 @@
+import time
+
+import dashboard
+from bench.synth import make_csv, make_items
+
+SIZES = [100, 1000, 10000]
+
+
+def time_call(fn, min_seconds):
+    samples = []
+    start = time.perf_counter()
+    while True:
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+        if time.perf_counter() - start >= min_seconds and len(samples) >= 3:
+            break
+    samples.sort()
+    return {
+        "runs": len(samples),
+        "best_ms": round(samples[0] * 1000, 3),
+        "median_ms": round(samples[len(samples) // 2] * 1000, 3),
+    }
+
+
+def run(sizes=SIZES, min_seconds=0.5):
+    page = (dashboard.ROOT / "recliners").read_text(encoding="utf-8")
+    results = []
+    for size in sizes:
+        csv_text = make_csv(size)
+        items = make_items(size)
+        table = dashboard.build_cards_table(items)
+        cases = {
+            "parse_csv_sections": lambda: dashboard.parse_csv_sections(csv_text),
+            "card_html": lambda: [dashboard.card_html(item) for item in items],
+            "build_cards_table": lambda: dashboard.build_cards_table(items),
+            "replace_cards_section": lambda: dashboard.replace_cards_section(page, table),
+            "render_wrapper": lambda: dashboard.render_wrapper("recliners", page.replace("<!-- Logic -->", table + "<!-- Logic -->")),
+        }
+        for name, fn in cases.items():
+            result = time_call(fn, min_seconds)
+            result.update({"name": name, "rows_per_section": size})
+            results.append(result)
+    return results
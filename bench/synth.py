@@ -0,0 +1,42 @@
+import csv
+import io
+
+SECTION_HEADERS = ["Living Room", "Bedroom", "Dinning Room", "Recliner"]
+
+
+def make_items(count, plain=False):
+    # A realistic export repeats collection names, "includes" lists and
+    # badges across many rows; only the image and prices vary per item.
+    return [
+        {
+            "includes": f"Sofa / Loveseat / Chair {i % 12}" if plain else f"Sofa, Loveseat, Chair {i % 12}",
+            "name": f"Collection {i % 40}",
+            "price": f"${(i * 37) % 3000 + 99}" if plain else f"${(i * 37) % 3000 + 99:,}",
+            "reg": f"${(i * 37) % 3000 + 599}" if plain else f"${(i * 37) % 3000 + 599:,}",
+            "qty": str(i % 5),
+            "badge": "Hot Buy" if i % 7 == 0 else "",
+            "img": f"https://images.example.com/specials/{i}.png",
+        }
+        for i in range(count)
+    ]
+
+
+def make_csv(rows_per_section, sections=SECTION_HEADERS, seed=0, plain=False):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["Category"] + [f"Column {i}" for i in range(1, 27)])
+    for header in sections:
+        writer.writerow([header] + [""] * 26)
+        writer.writerow(["NEW PRODUCT"] + [""] * 26)
+        for i, item in enumerate(make_items(rows_per_section, plain)):
+            row = [""] * 27
+            row[0] = f"SKU-{seed}-{i}"
+            row[6] = item["includes"]
+            row[7] = f"{header} {item['name']} #{i}"
+            row[8] = item["price"]
+            row[17] = item["reg"]
+            row[24] = f"{item['qty']} left"
+            row[25] = item["badge"]
+            row[26] = item["img"]
+            writer.writerow(row)
+    return out.getvalue()
@@ -1,16 +1,54 @@
 #!/usr/bin/env python3
+import argparse
+import cProfile
+import concurrent.futures
 import csv
+import ctypes
+import ctypes.util
+import difflib
+import functools
+import gzip
+import hashlib
 import html
 import io
+import itertools
 import json
+import marshal
+import mmap
+import multiprocessing
+import operator
 import os
+import pstats
+import queue
 import re
+import selectors
+import socket
+import sqlite3
+import stat
+import struct
+import sys
+import threading
 import time
-from urllib.parse import quote
+import zlib
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote, unquote
+from urllib.request import urlopen
 from pathlib import Path
 from urllib.parse import parse_qs, urlparse
 from http.server import BaseHTTPRequestHandler, HTTPServer
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 ROOT = Path(__file__).resolve().parent
 SCRIPT_NAME = Path(__file__).name
 EXCLUDE = {SCRIPT_NAME}
@@ -22,19 +60,1268 @@ SECTION_FILES = {
 }
 
 
-def list_files():
-    files = []
-    for name in os.listdir(ROOT):
-        if name.startswith('.'):
+def env_int(name, default):
+    try:
+        return int(os.environ.get(name, str(default)))
+    except ValueError:
+        return default
+
+
+WORKERS = max(1, env_int("WORKERS", 8))
+QUEUE_SIZE = max(1, env_int("QUEUE_SIZE", 64))
+KEEPALIVE_TIMEOUT = max(1, env_int("KEEPALIVE_TIMEOUT", 15))
+EVENTS_MAX_CLIENTS = max(0, env_int("EVENTS_MAX_CLIENTS", 1000))
+EVENTS_HEARTBEAT = max(1, env_int("EVENTS_HEARTBEAT", 15))
+EVENTS_DEBOUNCE_MS = max(0, env_int("EVENTS_DEBOUNCE_MS", 100))
+PAGE_CACHE_SIZE = max(0, env_int("PAGE_CACHE_SIZE", 64))
+MAX_UPLOAD_BYTES = max(1, env_int("MAX_UPLOAD_BYTES", 32 * 1024 * 1024))
+ENABLE_PROFILING = env_int("ENABLE_PROFILING", 0) != 0
+MAX_PROFILE_SECONDS = max(1, env_int("MAX_PROFILE_SECONDS", 60))
+CATALOG_WATCH = os.environ.get("CATALOG_WATCH", "auto")
+CATALOG_POLL_SECONDS = max(1, env_int("CATALOG_POLL_SECONDS", 2))
+HISTORY_PAGE_SIZE = max(1, env_int("HISTORY_PAGE_SIZE", 20))
+VERSION_STORE = env_int("VERSION_STORE", 1) != 0
+VERSION_KEEP = max(0, env_int("VERSION_KEEP", 50))
+VERSION_KEEP_DAYS = max(0, env_int("VERSION_KEEP_DAYS", 90))
+VERSION_DELTAS = env_int("VERSION_DELTAS", 0) != 0
+VERSION_MAX_CHAIN = max(1, env_int("VERSION_MAX_CHAIN", 16))
+RENDER_POOL = os.environ.get("RENDER_POOL", "process")
+RENDER_WORKERS = max(1, env_int("RENDER_WORKERS", min(4, os.cpu_count() or 1)))
+PARALLEL_RENDER_MIN_ITEMS = max(0, env_int("PARALLEL_RENDER_MIN_ITEMS", 200))
+WRITE_WORKERS = max(1, env_int("WRITE_WORKERS", 4))
+KEEP_LOGIC_SCRIPT = env_int("KEEP_LOGIC_SCRIPT", 0) != 0
+OPTIMIZE_PAGES = env_int("OPTIMIZE_PAGES", 0) != 0
+ASSET_BASE_URL = os.environ.get("ASSET_BASE_URL", "/assets").rstrip("/")
+IMAGE_SOURCE_DIR = os.environ.get("IMAGE_SOURCE_DIR", "")
+IMAGE_FETCH = env_int("IMAGE_FETCH", 0) != 0
+IMAGE_FETCH_TIMEOUT = max(1, env_int("IMAGE_FETCH_TIMEOUT", 10))
+IMAGE_RETRY_SECONDS = max(0, env_int("IMAGE_RETRY_SECONDS", 24 * 3600))
+IMAGE_WIDTHS = sorted({int(w) for w in os.environ.get("IMAGE_WIDTHS", "320,640,960").split(",") if w.strip().isdigit()})
+IMAGE_FORMAT = "jpeg" if os.environ.get("IMAGE_FORMAT", "webp").lower() in {"jpg", "jpeg"} else "webp"
+IMAGE_QUALITY = min(95, max(30, env_int("IMAGE_QUALITY", 80)))
+IMAGE_BASE_URL = os.environ.get("IMAGE_BASE_URL", "").rstrip("/")
+IMAGE_SIZES = os.environ.get("IMAGE_SIZES", "(max-width: 640px) 100vw, 50vw")
+INVENTORY_STORE = env_int("INVENTORY_STORE", 1) != 0
+ITEMS_PAGE_SIZE = max(1, env_int("ITEMS_PAGE_SIZE", 50))
+CSV_PARSER = os.environ.get("CSV_PARSER", "fast")
+CSV_COLUMNS = os.environ.get("CSV_COLUMNS", "")
+WARMUP = env_int("WARMUP", 1) != 0
+CARDS_PAGE_SIZE = max(0, env_int("CARDS_PAGE_SIZE", 0))
+FRAGMENT_BASE_URL = os.environ.get("FRAGMENT_BASE_URL", "").rstrip("/")
+INCREMENTAL_UPLOADS = env_int("INCREMENTAL_UPLOADS", 1) != 0
+GZIP_MIN_SIZE = max(0, env_int("GZIP_MIN_SIZE", 1024))
+GZIP_LEVEL = min(9, max(1, env_int("GZIP_LEVEL", 6)))
+
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+
+def file_lock(name):
+    with _file_locks_guard:
+        lock = _file_locks.get(name)
+        if lock is None:
+            lock = _file_locks[name] = threading.Lock()
+        return lock
+
+
+class PageCache:
+    def __init__(self, max_entries=PAGE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, stamp):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, stamp, value):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (stamp, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+PAGE_CACHE = PageCache()
+
+
+class CachedBody:
+    def __init__(self, body, content_type, mtime):
+        self.body = body
+        self.content_type = content_type
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gzip"'
+        self.mtime = int(mtime)
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        self._gzipped = None
+        self.assets = {}
+
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=GZIP_LEVEL, mtime=0)
+        return self._gzipped
+
+
+class FileBody:
+    def __init__(self, st):
+        self.size = st.st_size
+        self.mtime = int(st.st_mtime)
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        self.etag = f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+        self.gzip_etag = self.etag
+
+
+SEND_CHUNK = 256 * 1024
+
+
+def parse_range(header, size):
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, sep, last = header[6:].strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if start > end and start < size:
+                return None
+        else:
+            length = int(last)
+            if length == 0:
+                return False
+            start, end = max(0, size - length), size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return False
+    return start, end
+
+
+def accepts_gzip(header):
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        if token.strip().lower() not in {"gzip", "*"}:
             continue
+        params = params.strip().replace(" ", "")
+        if params.startswith("q="):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def etag_matches(header, entry):
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == "*" or tag in {entry.etag, entry.gzip_etag}:
+            return True
+    return False
+
+
+METRIC_ROUTES = ("/", "/render", "/raw", "/save", "/upload-csv", "/upload-csv-stream")
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_request_state = threading.local()
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {}
+        self.phases = {}
+        self.responses = {}
+        self.bytes_in = {}
+        self.bytes_out = {}
+
+    def record(self, route, status, seconds, bytes_in, bytes_out, phases):
+        with self.lock:
+            self.latency.setdefault(route, Histogram()).observe(seconds)
+            for phase, spent in phases.items():
+                self.phases.setdefault((route, phase), Histogram()).observe(spent)
+            key = (route, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+            self.bytes_in[route] = self.bytes_in.get(route, 0) + bytes_in
+            self.bytes_out[route] = self.bytes_out.get(route, 0) + bytes_out
+
+    def render(self, cache_stats):
+        lines = []
+
+        def histogram(name, help_text, series):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, hist in series:
+                cumulative = 0
+                for bound, count in zip(hist.buckets, hist.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+                lines.append(f"{name}_sum{{{labels}}} {hist.total:.6f}")
+                lines.append(f"{name}_count{{{labels}}} {hist.count}")
+
+        def counter(name, help_text, series, kind="counter"):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in series:
+                lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+
+        with self.lock:
+            histogram(
+                "dashboard_request_duration_seconds",
+                "Time spent handling a request, from parsed headers to last byte written.",
+                [(f'route="{route}"', hist) for route, hist in sorted(self.latency.items())],
+            )
+            histogram(
+                "dashboard_phase_duration_seconds",
+                "Time spent per request in the parse, render and io phases.",
+                [(f'route="{route}",phase="{phase}"', hist) for (route, phase), hist in sorted(self.phases.items())],
+            )
+            counter(
+                "dashboard_responses_total",
+                "Responses sent by route and status code.",
+                [(f'route="{route}",code="{code}"', count) for (route, code), count in sorted(self.responses.items())],
+            )
+            counter(
+                "dashboard_request_bytes_total",
+                "Request body bytes received.",
+                [(f'route="{route}"', count) for route, count in sorted(self.bytes_in.items())],
+            )
+            counter(
+                "dashboard_response_bytes_total",
+                "Response body bytes sent.",
+                [(f'route="{route}"', count) for route, count in sorted(self.bytes_out.items())],
+            )
+        counter("dashboard_cache_hits_total", "Response cache hits.", [("", cache_stats["hits"])])
+        counter("dashboard_cache_misses_total", "Response cache misses.", [("", cache_stats["misses"])])
+        counter("dashboard_cache_entries", "Entries currently held in the response cache.", [("", cache_stats["entries"])], "gauge")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+@contextmanager
+def timed(phase):
+    phases = getattr(_request_state, "phases", None)
+    if phases is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[phase] = phases.get(phase, 0.0) + time.perf_counter() - start
+
+
+class LiveProfiler:
+    # From 3.12 cProfile runs on sys.monitoring: only one profiler can be
+    # enabled at a time, and that one already sees every thread.
+    process_wide = sys.version_info >= (3, 12)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.deadline = 0.0
+        self.profiles = []
+        self.window = None
+
+    def active(self):
+        return time.monotonic() < self.deadline
+
+    def per_request(self):
+        return not self.process_wide and self.active()
+
+    def start(self, seconds):
+        with self.lock:
+            if self.active():
+                return False
+            self.profiles = []
+            if self.process_wide:
+                profile = cProfile.Profile()
+                try:
+                    profile.enable()
+                except ValueError:
+                    return False
+                self.window = profile
+            self.deadline = time.monotonic() + seconds
+            return True
+
+    def add(self, profile):
+        with self.lock:
+            self.profiles.append(profile)
+
+    def report(self, sort_key, limit):
+        with self.lock:
+            profiles, self.profiles = self.profiles, []
+            window, self.window = self.window, None
+        if window is not None:
+            window.disable()
+            profiles.append(window)
+        profiles = [profile for profile in profiles if has_stats(profile)]
+        if not profiles:
+            return "No requests were handled while profiling.\n"
+        out = io.StringIO()
+        if window is not None:
+            out.write("All threads profiled\n\n")
+        else:
+            out.write(f"{len(profiles)} requests profiled\n\n")
+        stats = pstats.Stats(profiles[0], stream=out)
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.strip_dirs().sort_stats(sort_key).print_stats(limit)
+        return out.getvalue()
+
+
+def has_stats(profile):
+    profile.create_stats()
+    return bool(profile.stats)
+
+
+PROFILER = LiveProfiler()
+
+
+class EventHub:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients = set()
+        self.pending = {}
+        self.pending_since = None
+        self.stamps = {}
+        self.next_id = 0
+        self.selector = None
+        self.wake_r = None
+        self.wake_w = None
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.selector = selectors.DefaultSelector()
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+        self.thread = threading.Thread(target=self.run, name="event-hub", daemon=True)
+        self.thread.start()
+
+    def available(self):
+        with self.lock:
+            return len(self.clients) < EVENTS_MAX_CLIENTS
+
+    def owns(self, sock):
+        with self.lock:
+            return sock in self.clients
+
+    def attach(self, sock):
+        with self.lock:
+            if len(self.clients) >= EVENTS_MAX_CLIENTS:
+                return False
+            self.start()
+            sock.setblocking(False)
+            self.clients.add(sock)
+            self.selector.register(sock, selectors.EVENT_READ)
+        return True
+
+    def drop(self, sock):
+        self.clients.discard(sock)
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+    def emit(self, key, event, data):
+        with self.lock:
+            if not self.clients:
+                return
+            previous = self.pending.get(key)
+            if previous is not None and previous[1].get("scope") == "page":
+                data = dict(data, scope="page")
+            self.pending[key] = (event, data)
+            if self.pending_since is None:
+                self.pending_since = time.monotonic()
+        try:
+            self.wake_w.send(b"\0")
+        except OSError:
+            pass
+
+    def claim(self, name, stamp):
+        with self.lock:
+            self.stamps[name] = stamp
+
+    def announce(self, name, scope="page"):
+        self.emit(("change", name), "change", {"file": name, "scope": scope})
+
+    def file_changed(self, root, name):
+        if not self.clients:
+            return
+        try:
+            st = os.stat(root / name)
+        except OSError:
+            return
+        stamp = file_stamp(st)
+        with self.lock:
+            if self.stamps.get(name) == stamp:
+                return
+            self.stamps[name] = stamp
+        self.announce(name)
+
+    def history_changed(self, name):
+        self.emit(("history", name), "history", {"file": name})
+
+    def broadcast(self, frame):
+        for sock in list(self.clients):
+            try:
+                sent = sock.send(frame)
+            except OSError:
+                sent = -1
+            if sent != len(frame):
+                self.drop(sock)
+
+    def run(self):
+        last_beat = time.monotonic()
+        while True:
+            now = time.monotonic()
+            with self.lock:
+                since = self.pending_since
+            timeout = EVENTS_HEARTBEAT - (now - last_beat)
+            if since is not None:
+                timeout = min(timeout, since + EVENTS_DEBOUNCE_MS / 1000 - now)
+            for key, _ in self.selector.select(max(0.0, timeout)):
+                if key.fileobj is self.wake_r:
+                    try:
+                        while self.wake_r.recv(4096):
+                            pass
+                    except OSError:
+                        pass
+                    continue
+                try:
+                    alive = key.fileobj.recv(4096)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    alive = b""
+                if not alive:
+                    with self.lock:
+                        self.drop(key.fileobj)
+            now = time.monotonic()
+            with self.lock:
+                if self.pending_since is not None and now - self.pending_since >= EVENTS_DEBOUNCE_MS / 1000:
+                    frames = []
+                    for event, data in self.pending.values():
+                        self.next_id += 1
+                        frames.append(f"id: {self.next_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n")
+                    self.pending = {}
+                    self.pending_since = None
+                    self.broadcast("".join(frames).encode("utf-8"))
+                    last_beat = now
+                elif now - last_beat >= EVENTS_HEARTBEAT:
+                    self.broadcast(b": ping\n\n")
+                    last_beat = now
+
+
+EVENTS = EventHub()
+
+
+def file_stamp(st):
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+VERSION_NAME_RE = re.compile(r"^(?P<stem>.+)-(?P<ts>\d{8}-\d{6})(?:-\d+)?(?P<suffix>\.[^.]*)?$")
+BACKUP_NAME_RE = re.compile(r"^(?P<base>.+)\.bak-(?P<ts>\d{8}-\d{6})(?:-\d+)?$")
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def classify_name(name):
+    match = BACKUP_NAME_RE.match(name)
+    if match:
+        return "backup", match.group("base"), match.group("ts")
+    match = VERSION_NAME_RE.match(name)
+    if match:
+        return "version", match.group("stem") + (match.group("suffix") or ""), match.group("ts")
+    return "page", name, ""
+
+
+class FileCatalog:
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.files = {}
+        self.version = 0
+        self.changed_at = time.time()
+        self.root_stamp = None
+        self.watcher = None
+        self._pages = None
+
+    def listable(self, name):
+        return not name.startswith(".") and name not in EXCLUDE
+
+    def scan(self):
+        files = {}
+        try:
+            st = os.stat(self.root)
+            with os.scandir(self.root) as entries:
+                for entry in entries:
+                    if self.listable(entry.name) and entry.is_file():
+                        files[entry.name] = classify_name(entry.name)
+        except OSError:
+            return
+        with self.lock:
+            self.root_stamp = (st.st_mtime_ns, st.st_ino)
+            if files != self.files:
+                self.files = files
+                self.touch()
+
+    def changed(self, name):
+        if not self.listable(name):
+            return
+        kind, base, _ = classify_name(name)
+        if kind == "page":
+            EVENTS.file_changed(self.root, name)
+        else:
+            EVENTS.history_changed(base)
+
+    def touch(self):
+        self.version += 1
+        self.changed_at = time.time()
+        self._pages = None
+
+    def ensure_fresh(self):
+        if self.watcher is not None and self.watcher.is_alive() and self.root_stamp is not None:
+            return
+        try:
+            st = os.stat(self.root)
+        except OSError:
+            return
+        if (st.st_mtime_ns, st.st_ino) != self.root_stamp:
+            self.scan()
+
+    def add(self, name):
+        if not self.listable(name):
+            return
+        if not (self.root / name).is_file():
+            self.discard(name)
+            return
+        with self.lock:
+            if name not in self.files:
+                self.files[name] = classify_name(name)
+                self.touch()
+
+    def discard(self, name):
+        with self.lock:
+            if self.files.pop(name, None) is not None:
+                self.touch()
+
+    def stamp(self):
+        self.ensure_fresh()
+        with self.lock:
+            return ("catalog", self.version), self.changed_at
+
+    def pages(self):
+        self.ensure_fresh()
+        with self.lock:
+            if self._pages is None:
+                pages = set()
+                for name, (kind, base, _) in self.files.items():
+                    if kind == "page" or base not in self.files:
+                        pages.add(name)
+                self._pages = sorted(pages, key=lambda s: s.lower())
+            return list(self._pages)
+
+    def history(self, base):
+        self.ensure_fresh()
+        with self.lock:
+            names = [
+                (ts, name, kind)
+                for name, (kind, owner, ts) in self.files.items()
+                if kind != "page" and owner == base
+            ]
+        names.sort(reverse=True)
+        items = []
+        for ts, name, kind in names:
+            try:
+                st = os.stat(self.root / name)
+            except OSError:
+                continue
+            items.append({"file": name, "kind": kind, "ts": ts, "size": st.st_size, "mtime": int(st.st_mtime)})
+        return items
+
+    def start(self, mode=CATALOG_WATCH):
+        self.scan()
+        if mode in {"auto", "inotify"} and self.start_inotify():
+            return "inotify"
+        if mode == "off":
+            return "off"
+        self.watcher = threading.Thread(target=self.poll, name="catalog-poll", daemon=True)
+        self.watcher.start()
+        return "poll"
+
+    def start_inotify(self):
+        if not hasattr(os, "O_CLOEXEC"):
+            return False
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return False
+        if fd < 0:
+            return False
+        mask = (
+            IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+            | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+        )
+        if libc.inotify_add_watch(fd, os.fsencode(self.root), mask) < 0:
+            os.close(fd)
+            return False
+        self.watcher = threading.Thread(target=self.read_inotify, args=(fd,), name="catalog-inotify", daemon=True)
+        self.watcher.start()
+        return True
+
+    def read_inotify(self, fd):
+        try:
+            while True:
+                data = os.read(fd, 64 * 1024)
+                offset = 0
+                while offset + INOTIFY_EVENT.size <= len(data):
+                    _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                    offset += INOTIFY_EVENT.size
+                    name = os.fsdecode(data[offset: offset + length].rstrip(b"\0"))
+                    offset += length
+                    if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                        return
+                    if mask & IN_Q_OVERFLOW:
+                        self.scan()
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        self.discard(name)
+                    elif name:
+                        self.add(name)
+                        if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                            self.changed(name)
+        except OSError:
+            return
+        finally:
+            os.close(fd)
+            self.watcher = None
+
+    def poll(self):
+        stamps = {}
+        while True:
+            time.sleep(CATALOG_POLL_SECONDS)
+            try:
+                st = os.stat(self.root)
+            except OSError:
+                continue
+            if (st.st_mtime_ns, st.st_ino) != self.root_stamp:
+                before = set(self.files)
+                self.scan()
+                for name in set(self.files) - before:
+                    self.changed(name)
+            for name in self.pages():
+                try:
+                    stamp = file_stamp(os.stat(self.root / name))
+                except OSError:
+                    continue
+                if stamps.get(name, stamp) != stamp:
+                    self.changed(name)
+                stamps[name] = stamp
+
+
+CATALOG = FileCatalog(ROOT)
+
+
+def write_atomic(path, data):
+    tmp = path.with_name(f".{path.name}.tmp-{os.getpid()}-{threading.get_ident()}")
+    with open(tmp, "wb") as fh:
+        fh.write(data)
+    os.replace(tmp, path)
+
+
+def version_dir(root):
+    configured = os.environ.get("VERSION_DIR")
+    return Path(configured) if configured else root / ".versions"
+
+
+class VersionStore:
+    def __init__(self, path):
+        self.path = path
+        self.objects = path / "objects"
+        self.logs = path / "log"
+        self.lock = threading.RLock()
+
+    def object_path(self, digest):
+        return self.objects / digest[:2] / digest[2:]
+
+    def log_path(self, name):
+        return self.logs / (quote(name, safe="") + ".json")
+
+    def load_log(self, name):
+        try:
+            return json.loads(self.log_path(name).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return []
+
+    def save_log(self, name, entries):
+        self.logs.mkdir(parents=True, exist_ok=True)
+        write_atomic(self.log_path(name), json.dumps(entries, indent=1).encode("utf-8"))
+
+    def read_object(self, digest):
+        data = zlib.decompress(self.object_path(digest).read_bytes())
+        if data[:1] == b"F":
+            return data[1:]
+        delta = json.loads(data[1:])
+        base = self.read_object(delta["base"]).decode("utf-8").splitlines(keepends=True)
+        out = []
+        for op in delta["ops"]:
+            if op[0] == "=":
+                out.extend(base[op[1]: op[2]])
+            else:
+                out.extend(op[1])
+        return "".join(out).encode("utf-8")
+
+    def object_base(self, digest):
+        data = zlib.decompress(self.object_path(digest).read_bytes())
+        if data[:1] == b"D":
+            return json.loads(data[1:])["base"]
+        return None
+
+    def chain_length(self, digest):
+        length = 0
+        while digest is not None and length <= VERSION_MAX_CHAIN:
+            digest = self.object_base(digest)
+            length += 1
+        return length
+
+    def encode_object(self, raw, base_digest):
+        if VERSION_DELTAS and base_digest and self.chain_length(base_digest) < VERSION_MAX_CHAIN:
+            try:
+                base = self.read_object(base_digest).decode("utf-8").splitlines(keepends=True)
+                lines = raw.decode("utf-8").splitlines(keepends=True)
+            except (OSError, UnicodeDecodeError, zlib.error, ValueError):
+                base = None
+            if base is not None:
+                ops = []
+                matcher = difflib.SequenceMatcher(None, base, lines, autojunk=False)
+                for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                    if tag == "equal":
+                        ops.append(["=", i1, i2])
+                    elif j2 > j1:
+                        ops.append(["+", lines[j1:j2]])
+                delta = b"D" + json.dumps({"base": base_digest, "ops": ops}).encode("utf-8")
+                if len(delta) < len(raw) // 2:
+                    return zlib.compress(delta, 9)
+        return zlib.compress(b"F" + raw, 9)
+
+    def record(self, name, content, kind, when=None):
+        raw = content.encode("utf-8")
+        digest = hashlib.sha256(raw).hexdigest()
+        when = time.time() if when is None else when
+        with self.lock:
+            entries = self.load_log(name)
+            latest = max(entries, key=lambda e: e["time"]) if entries else None
+            if latest is not None and latest["hash"] == digest:
+                return latest
+            target = self.object_path(digest)
+            if not target.exists():
+                target.parent.mkdir(parents=True, exist_ok=True)
+                write_atomic(target, self.encode_object(raw, latest["hash"] if latest else None))
+            entry = {
+                "id": max((e["id"] for e in entries), default=0) + 1,
+                "hash": digest,
+                "kind": kind,
+                "time": when,
+                "ts": time.strftime("%Y%m%d-%H%M%S", time.localtime(when)),
+                "size": len(raw),
+            }
+            entries.append(entry)
+            entries.sort(key=lambda e: (e["time"], e["id"]))
+            self.save_log(name, entries)
+            self.apply_retention(name)
+        EVENTS.history_changed(name)
+        return entry
+
+    def versions(self, name):
+        return sorted(self.load_log(name), key=lambda e: (e["time"], e["id"]), reverse=True)
+
+    def find(self, name, version_id):
+        for entry in self.load_log(name):
+            if entry["id"] == version_id:
+                return entry
+        return None
+
+    def read(self, name, version_id):
+        entry = self.find(name, version_id)
+        if entry is None:
+            return None
+        return self.read_object(entry["hash"]).decode("utf-8", errors="replace")
+
+    def apply_retention(self, name, keep=None, keep_days=None):
+        keep = VERSION_KEEP if keep is None else keep
+        keep_days = VERSION_KEEP_DAYS if keep_days is None else keep_days
+        if not keep and not keep_days:
+            return 0
+        with self.lock:
+            entries = self.versions(name)
+            cutoff = time.time() - keep_days * 86400
+            kept = [
+                entry for index, entry in enumerate(entries)
+                if (keep and index < keep) or (keep_days and entry["time"] >= cutoff)
+            ]
+            pruned = len(entries) - len(kept)
+            if pruned:
+                self.save_log(name, sorted(kept, key=lambda e: (e["time"], e["id"])))
+                self.collect_garbage()
+            return pruned
+
+    def collect_garbage(self):
+        with self.lock:
+            live = set()
+            for log in self.logs.glob("*.json"):
+                try:
+                    entries = json.loads(log.read_text(encoding="utf-8"))
+                except (OSError, ValueError):
+                    continue
+                for entry in entries:
+                    digest = entry["hash"]
+                    while digest and digest not in live:
+                        live.add(digest)
+                        try:
+                            digest = self.object_base(digest)
+                        except (OSError, zlib.error, ValueError):
+                            digest = None
+            removed = 0
+            for obj in self.objects.glob("*/*"):
+                if obj.parent.name + obj.name not in live and not obj.name.startswith("."):
+                    obj.unlink(missing_ok=True)
+                    removed += 1
+            return removed
+
+    def diff(self, name, a, b):
+        old = self.read(name, a)
+        if old is None:
+            return None
+        if b == "current":
+            path = ROOT / name
+            if not path.is_file():
+                return None
+            new = path.read_text(encoding="utf-8", errors="replace")
+            to_label = f"{name} (current)"
+        else:
+            new = self.read(name, b)
+            if new is None:
+                return None
+            to_label = f"{name}@{b}"
+        lines = difflib.unified_diff(
+            old.splitlines(keepends=True),
+            new.splitlines(keepends=True),
+            fromfile=f"{name}@{a}",
+            tofile=to_label,
+        )
+        return "".join(lines)
+
+    def restore(self, name, version_id):
+        content = self.read(name, version_id)
+        if content is None:
+            return None
         path = ROOT / name
-        if not path.is_file():
-            continue
-        if name in EXCLUDE:
-            continue
-        files.append(name)
-    files.sort(key=lambda s: s.lower())
-    return files
+        with file_lock(name):
+            current = path.read_text(encoding="utf-8", errors="replace")
+            backup = self.record(name, current, "backup")
+            publish_files(ROOT, {name: content})
+        return backup
+
+    def import_legacy(self, root, catalog):
+        imported = 0
+        for page in catalog.pages():
+            for item in reversed(catalog.history(page)):
+                path = root / item["file"]
+                try:
+                    content = path.read_text(encoding="utf-8", errors="replace")
+                    when = time.mktime(time.strptime(item["ts"], "%Y%m%d-%H%M%S"))
+                except (OSError, ValueError):
+                    continue
+                self.record(page, content, "save" if item["kind"] == "version" else "backup", when)
+                path.unlink()
+                catalog.discard(item["file"])
+                imported += 1
+        return imported
+
+
+VERSIONS = VersionStore(version_dir(ROOT))
+
+
+def image_dir(root):
+    configured = os.environ.get("IMAGE_DIR")
+    return Path(configured) if configured else root / ".images"
+
+
+IMAGE_TYPES = {".webp": "image/webp", ".jpg": "image/jpeg", ".png": "image/png", ".gif": "image/gif"}
+
+
+def image_size(data):
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        return struct.unpack(">II", data[16:24])
+    if data[:6] in {b"GIF87a", b"GIF89a"} and len(data) >= 10:
+        return struct.unpack("<HH", data[6:10])
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP" and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b"VP8X":
+            return 1 + int.from_bytes(data[24:27], "little"), 1 + int.from_bytes(data[27:30], "little")
+        if chunk == b"VP8L":
+            bits = int.from_bytes(data[21:25], "little")
+            return 1 + (bits & 0x3FFF), 1 + ((bits >> 14) & 0x3FFF)
+        if chunk == b"VP8 ":
+            width, height = struct.unpack("<HH", data[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+    if data[:2] == b"\xff\xd8":
+        pos = 2
+        while pos + 9 < len(data):
+            if data[pos] != 0xFF:
+                pos += 1
+                continue
+            marker = data[pos + 1]
+            if marker in {0xD8, 0xFF} or 0xD0 <= marker <= 0xD7:
+                pos += 1 if marker == 0xFF else 2
+                continue
+            length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+            if 0xC0 <= marker <= 0xCF and marker not in {0xC4, 0xC8, 0xCC}:
+                height, width = struct.unpack(">HH", data[pos + 5:pos + 9])
+                return width, height
+            pos += 2 + length
+    return None
+
+
+def read_image_source(url):
+    if IMAGE_SOURCE_DIR:
+        folder = Path(IMAGE_SOURCE_DIR)
+        path = unquote(urlparse(url).path)
+        for candidate in (folder / path.lstrip("/"), folder / Path(path).name):
+            if candidate.is_file():
+                return candidate.read_bytes()
+    if IMAGE_FETCH and urlparse(url).scheme in {"http", "https"}:
+        with urlopen(url, timeout=IMAGE_FETCH_TIMEOUT) as resp:
+            return resp.read()
+    return None
+
+
+class ImageCache:
+    def __init__(self, path, fetcher=read_image_source):
+        self.path = path
+        self.fetcher = fetcher
+        self.lock = threading.Lock()
+        self.index = None
+
+    @property
+    def enabled(self):
+        return bool(IMAGE_SOURCE_DIR or IMAGE_FETCH or self.fetcher is not read_image_source)
+
+    def load_index(self):
+        if self.index is None:
+            try:
+                self.index = json.loads((self.path / "index.json").read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                self.index = {}
+        return self.index
+
+    def save_index(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        write_atomic(self.path / "index.json", json.dumps(self.index, indent=1, sort_keys=True).encode("utf-8"))
+
+    def variants(self, digest, data, width, height):
+        if Image is None:
+            return []
+        ext = ".webp" if IMAGE_FORMAT == "webp" else ".jpg"
+        widths = [w for w in IMAGE_WIDTHS if w < width] + [min(width, max(IMAGE_WIDTHS or [width]))]
+        out = []
+        source = None
+        for target in sorted(set(widths)):
+            name = f"{digest}-{target}{ext}"
+            path = self.path / name
+            if not path.exists():
+                if source is None:
+                    source = Image.open(io.BytesIO(data))
+                    source.load()
+                    if IMAGE_FORMAT == "jpeg" or source.mode not in {"RGB", "RGBA"}:
+                        source = source.convert("RGB" if IMAGE_FORMAT == "jpeg" else "RGBA")
+                resized = source.resize((target, max(1, round(height * target / width))), Image.LANCZOS)
+                buf = io.BytesIO()
+                resized.save(buf, "WEBP" if ext == ".webp" else "JPEG", quality=IMAGE_QUALITY)
+                write_atomic(path, buf.getvalue())
+            out.append([target, name])
+        return out
+
+    def process(self, url):
+        data = self.fetcher(url)
+        if not data:
+            return None
+        size = image_size(data)
+        if size is None and Image is not None:
+            try:
+                size = Image.open(io.BytesIO(data)).size
+            except OSError:
+                size = None
+        if size is None:
+            return None
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        self.path.mkdir(parents=True, exist_ok=True)
+        try:
+            variants = self.variants(digest, data, *size)
+        except OSError:
+            variants = []
+        return {"hash": digest, "width": size[0], "height": size[1], "variants": variants}
+
+    def prepare(self, items):
+        # Failed lookups are recorded too, so a dead URL is retried only
+        # after IMAGE_RETRY_SECONDS rather than on every upload.
+        retry_before = time.time() - IMAGE_RETRY_SECONDS
+        with self.lock:
+            index = self.load_index()
+            pending = sorted({
+                url for url in {item.get("img") for item in items if item.get("img")}
+                if url not in index or ("error" in index[url] and index[url].get("checked", 0) < retry_before)
+            })
+        if pending:
+            with timed("images"):
+                pool = executor("thread") if len(pending) > 1 else None
+                results = pool.map(self.safe_process, pending) if pool else map(self.safe_process, pending)
+                found = dict(zip(pending, results))
+            with self.lock:
+                self.index.update(found)
+                self.save_index()
+        with self.lock:
+            for item in items:
+                record = self.index.get(item.get("img"))
+                if record and "error" not in record:
+                    item["image"] = image_tuple(record)
+
+    def safe_process(self, url):
+        try:
+            record = self.process(url)
+        except (OSError, ValueError) as err:
+            return {"error": str(err) or type(err).__name__, "checked": int(time.time())}
+        return record or {"error": "No readable image", "checked": int(time.time())}
+
+
+def image_tuple(record):
+    # Published pages are served by the live site, not this dashboard, so
+    # only point cards at the variants when IMAGE_BASE_URL says where they live.
+    variants = record.get("variants") or []
+    if variants and IMAGE_BASE_URL:
+        src = f"{IMAGE_BASE_URL}/{variants[-1][1]}"
+        srcset = ", ".join(f"{IMAGE_BASE_URL}/{name} {w}w" for w, name in variants)
+        height = round(record["height"] * variants[-1][0] / record["width"])
+        return (src, srcset, str(variants[-1][0]), str(max(1, height)))
+    return ("", "", str(record["width"]), str(record["height"]))
+
+
+IMAGES = ImageCache(image_dir(ROOT))
+
+
+def inventory_path(root):
+    configured = os.environ.get("INVENTORY_DB")
+    return Path(configured) if configured else root / ".inventory.sqlite3"
+
+
+def money_value(value):
+    amount = extract_money(value)
+    return int(amount) if amount else None
+
+
+def qty_value(value):
+    qty = extract_qty(value)
+    return int(qty) if qty.isdigit() else None
+
+
+ITEM_COLUMNS = ("section", "position", "name", "includes", "img", "badge", "price_text", "reg_text", "qty_text", "price", "reg", "qty", "updated")
+ITEM_SORTS = {
+    "position": "section, position",
+    "price": "price IS NULL, price, section, position",
+    "-price": "price IS NULL, price DESC, section, position",
+    "discount": "reg - price IS NULL, reg - price DESC, section, position",
+    "qty": "qty IS NULL, qty, section, position",
+    "-qty": "qty IS NULL, qty DESC, section, position",
+    "name": "name COLLATE NOCASE, section, position",
+    "-name": "name COLLATE NOCASE DESC, section, position",
+}
+
+
+ITEM_FILTERS = (
+    ("min_price", "price", ">="),
+    ("max_price", "price", "<="),
+    ("min_reg", "reg", ">="),
+    ("max_reg", "reg", "<="),
+    ("min_qty", "qty", ">="),
+    ("max_qty", "qty", "<="),
+)
+
+
+class InventoryStore:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def connect(self):
+        if self.conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS items (
+                    section TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    includes TEXT NOT NULL,
+                    img TEXT NOT NULL,
+                    badge TEXT NOT NULL,
+                    price_text TEXT NOT NULL,
+                    reg_text TEXT NOT NULL,
+                    qty_text TEXT NOT NULL,
+                    price INTEGER,
+                    reg INTEGER,
+                    qty INTEGER,
+                    updated REAL NOT NULL,
+                    PRIMARY KEY (section, position)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS items_price ON items (section, price);
+                CREATE INDEX IF NOT EXISTS items_qty ON items (section, qty);
+            """)
+            self.conn = conn
+        return self.conn
+
+    def replace_sections(self, sections):
+        now = time.time()
+        rows = [
+            (
+                section, position, item.get("name", ""), item.get("includes", ""), item.get("img", ""),
+                item.get("badge", ""), item.get("price", ""), item.get("reg", ""), item.get("qty", ""),
+                money_value(item.get("price", "")), money_value(item.get("reg", "")), qty_value(item.get("qty", "")), now,
+            )
+            for section, items in sections.items()
+            for position, item in enumerate(items)
+        ]
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                conn.executemany("DELETE FROM items WHERE section = ?", [(section,) for section in sections])
+                conn.executemany(f"INSERT INTO items VALUES ({', '.join('?' * len(ITEM_COLUMNS))})", rows)
+
+    def sections(self, names=None):
+        with self.lock:
+            rows = self.connect().execute("SELECT * FROM items ORDER BY section, position").fetchall()
+        sections = {}
+        for row in rows:
+            if names and row["section"] not in names:
+                continue
+            sections.setdefault(row["section"], []).append({
+                "includes": row["includes"],
+                "name": row["name"],
+                "price": row["price_text"],
+                "reg": row["reg_text"],
+                "qty": row["qty_text"],
+                "badge": row["badge"],
+                "img": row["img"],
+            })
+        return sections
+
+    def query(self, sections=(), text="", filters=(), sort="position", limit=ITEMS_PAGE_SIZE, offset=0):
+        where = []
+        params = []
+        if sections:
+            where.append(f"section IN ({', '.join('?' * len(sections))})")
+            params.extend(sections)
+        if text:
+            where.append("(name LIKE ? ESCAPE '\\' OR includes LIKE ? ESCAPE '\\')")
+            pattern = "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            params.extend([pattern, pattern])
+        for column, op, value in filters:
+            where.append(f"{column} {op} ?")
+            params.append(value)
+        clause = f" WHERE {' AND '.join(where)}" if where else ""
+        with self.lock:
+            conn = self.connect()
+            total = conn.execute(f"SELECT COUNT(*) FROM items{clause}", params).fetchone()[0]
+            rows = conn.execute(
+                f"SELECT * FROM items{clause} ORDER BY {ITEM_SORTS[sort]} LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+        return total, [dict(row) for row in rows]
+
+
+INVENTORY = InventoryStore(inventory_path(ROOT))
+
+
+def set_root(root):
+    global ROOT, CATALOG, VERSIONS, IMAGES, INVENTORY
+    ROOT = Path(root)
+    CATALOG = FileCatalog(ROOT)
+    VERSIONS = VersionStore(version_dir(ROOT))
+    IMAGES = ImageCache(image_dir(ROOT), IMAGES.fetcher)
+    INVENTORY = InventoryStore(inventory_path(ROOT))
+    PAGE_CACHE.clear()
+
+
+def list_files():
+    return CATALOG.pages()
 
 
 def render_index(files):
@@ -148,6 +1435,18 @@ def render_index(files):
       background: #fffdf9;
     }}
     .current {{ font-weight: 700; }}
+    .history {{ display: grid; gap: 6px; max-height: 220px; overflow: auto; }}
+    .history-btn {{
+      border: 1px solid var(--line);
+      background: #ffffff;
+      color: var(--muted);
+      padding: 6px 10px;
+      border-radius: 10px;
+      font-size: 12px;
+      text-align: left;
+      cursor: pointer;
+    }}
+    .history-btn.active {{ border-color: var(--accent); color: var(--ink); }}
     iframe {{ width: 100%; height: 100%; border: 0; background: #f8fafc; }}
 
     @media (max-width: 900px) {{
@@ -162,6 +1461,8 @@ def render_index(files):
       <div class=\"title\">FDWEBSITE Preview</div>
       <div class=\"hint\">Pick a file to render it inside a full HTML shell.</div>
       <div id=\"file-list\" class=\"file-list\"></div>
+      <div class=\"hint\">History</div>
+      <div id=\"history\" class=\"history\"></div>
       <div class=\"upload\">
         <div class=\"hint\">Bulk update from CSV</div>
         <input id=\"csv-file\" type=\"file\" accept=\".csv,text/csv\" />
@@ -192,18 +1493,56 @@ def render_index(files):
     const csvFile = document.getElementById('csv-file');
     const uploadCsv = document.getElementById('upload-csv');
     const csvStatus = document.getElementById('csv-status');
+    const historyList = document.getElementById('history');
 
     let activeFile = null;
+    let activeVersion = null;
+    let events = null;
 
-    function loadFile(name) {{
-      const url = '/render?file=' + encodeURIComponent(name);
-      const raw = '/raw?file=' + encodeURIComponent(name);
+    function showFile(name, version) {{
+      activeVersion = version || null;
+      const query = '?file=' + encodeURIComponent(name) + (version ? '&version=' + version : '');
+      const url = '/render' + query;
+      const raw = '/raw' + query;
       frame.src = url;
-      current.textContent = name;
+      current.textContent = version ? name + ' (version ' + version + ')' : name;
       openTab.href = url;
       openRaw.href = raw;
+      const key = name + '#' + (version || '');
+      [...historyList.querySelectorAll('button')].forEach(btn => btn.classList.toggle('active', btn.dataset.key === key));
+    }}
+
+    async function loadHistory(name, page) {{
+      if (page === 1) historyList.textContent = '';
+      const res = await fetch('/api/history?file=' + encodeURIComponent(name) + '&page=' + page);
+      if (!res.ok || name !== activeFile) return;
+      const data = await res.json();
+      historyList.querySelector('.history-more')?.remove();
+      data.items.forEach(entry => {{
+        const btn = document.createElement('button');
+        btn.className = 'history-btn';
+        btn.textContent = (entry.kind === 'backup' ? 'Backup ' : 'Saved ') + entry.ts;
+        if (entry.version) btn.textContent += ' (v' + entry.version + ')';
+        btn.title = entry.version ? entry.file + ' version ' + entry.version : entry.file;
+        btn.dataset.key = entry.file + '#' + (entry.version || '');
+        btn.addEventListener('click', () => showFile(entry.file, entry.version));
+        historyList.appendChild(btn);
+      }});
+      if (page * data.per_page < data.total) {{
+        const more = document.createElement('button');
+        more.className = 'history-btn history-more';
+        more.textContent = 'Older...';
+        more.addEventListener('click', () => loadHistory(name, page + 1));
+        historyList.appendChild(more);
+      }}
+      if (!data.total) historyList.textContent = 'No saved versions.';
+    }}
+
+    function loadFile(name) {{
       activeFile = name;
+      showFile(name);
       [...list.querySelectorAll('button')].forEach(btn => btn.classList.toggle('active', btn.dataset.file === name));
+      loadHistory(name, 1);
     }}
 
     files.forEach(name => {{
@@ -221,21 +1560,22 @@ def render_index(files):
         return;
       }}
       try {{
-        const text = await csvFile.files[0].text();
         csvStatus.textContent = 'Uploading...';
-        const res = await fetch('/upload-csv', {{
+        const res = await fetch('/upload-csv-stream', {{
           method: 'POST',
-          headers: {{ 'Content-Type': 'application/json' }},
-          body: JSON.stringify({{ csv: text }})
+          headers: {{ 'Content-Type': 'text/csv' }},
+          body: csvFile.files[0]
         }});
         if (!res.ok) throw new Error('Upload failed');
         const data = await res.json();
         const updated = data.updated || {{}};
-        csvStatus.textContent = 'Updated: living room ' + (updated['living room'] || 0) +
-          ', bedroom ' + (updated['bedroom'] || 0) +
-          ', dining room ' + (updated['dining room'] || 0) +
-          ', recliner ' + (updated['recliner'] || 0);
-        if (activeFile) {{
+        const skipped = data.skipped || [];
+        const count = section => (updated[section] || 0) + (skipped.includes(section) ? ' (unchanged)' : '');
+        csvStatus.textContent = 'Updated: living room ' + count('living room') +
+          ', bedroom ' + count('bedroom') +
+          ', dining room ' + count('dining room') +
+          ', recliner ' + count('recliner');
+        if (activeFile && (!events || events.readyState !== EventSource.OPEN)) {{
           loadFile(activeFile);
         }}
       }} catch (err) {{
@@ -243,6 +1583,48 @@ def render_index(files):
       }}
     }});
 
+    function cardsRange(root) {{
+      const walker = document.createTreeWalker(root, NodeFilter.SHOW_COMMENT);
+      let start = null;
+      while (walker.nextNode()) {{
+        const text = walker.currentNode.nodeValue.trim();
+        if (text === 'Cards') start = walker.currentNode;
+        else if (text === 'Logic' && start) return [start, walker.currentNode];
+      }}
+      return null;
+    }}
+
+    async function patchPreview(name, scope) {{
+      const doc = frame.contentDocument;
+      const target = doc && doc.getElementById('fd-fragment');
+      if (!target) return showFile(name);
+      const range = scope === 'cards' ? cardsRange(target) : null;
+      const fragment = range ? 'cards' : 'page';
+      const res = await fetch('/render?file=' + encodeURIComponent(name) + '&fragment=' + fragment);
+      if (!res.ok || name !== activeFile || activeVersion) return;
+      const markup = await res.text();
+      if (!range) {{
+        target.innerHTML = markup;
+        return;
+      }}
+      const [start, end] = range;
+      while (start.nextSibling && start.nextSibling !== end) start.nextSibling.remove();
+      const nodes = doc.createRange().createContextualFragment(markup);
+      end.parentNode.insertBefore(nodes, end);
+    }}
+
+    if (window.EventSource) {{
+      events = new EventSource('/events');
+      events.addEventListener('change', evt => {{
+        const data = JSON.parse(evt.data);
+        if (data.file === activeFile && !activeVersion) patchPreview(data.file, data.scope).catch(() => showFile(data.file));
+      }});
+      events.addEventListener('history', evt => {{
+        const data = JSON.parse(evt.data);
+        if (data.file === activeFile) loadHistory(activeFile, 1);
+      }});
+    }}
+
     if (files.length) loadFile(files[0]);
   </script>
 </body>
@@ -284,10 +1666,24 @@ def render_raw(content):
     return content
 
 
+def render_fragment(content, fragment):
+    if fragment != "cards":
+        return content
+    start = content.find("<!-- Cards -->")
+    logic = content.find("<!-- Logic -->", start) if start != -1 else -1
+    if logic == -1:
+        return None
+    return content[start + len("<!-- Cards -->"): logic]
+
+
+MONEY_RE = re.compile(r"\$\s*([0-9][0-9,]*)")
+QTY_RE = re.compile(r"([0-9]+)")
+
+
 def extract_money(value):
     if not value:
         return ""
-    match = re.search(r"\$\s*([0-9][0-9,]*)", value)
+    match = MONEY_RE.search(value)
     if not match:
         return ""
     return match.group(1).replace(",", "")
@@ -296,15 +1692,13 @@ def extract_money(value):
 def extract_qty(value):
     if not value:
         return ""
-    match = re.search(r"([0-9]+)", value)
+    match = QTY_RE.search(value)
     return match.group(1) if match else value.strip()
 
 
-def parse_csv_sections(csv_text):
-    sections = {key: [] for key in SECTION_FILES.keys()}
+def iter_csv_sections_legacy(lines):
     current = None
-    reader = csv.reader(io.StringIO(csv_text))
-    for row in reader:
+    for row in csv.reader(lines):
         row = [cell.strip() for cell in row]
         if not any(row):
             continue
@@ -330,46 +1724,267 @@ def parse_csv_sections(csv_text):
             "badge": row[25].strip(),
             "img": row[26].strip(),
         }
-        sections[current].append(item)
-    return sections
+        yield current, item
 
 
-def card_html(item):
-    name = item.get("name") or item.get("sku") or "Item"
-    includes = item.get("includes") or ""
-    img = item.get("img") or ""
-    now = extract_money(item.get("price", ""))
-    reg = extract_money(item.get("reg", ""))
-    qty = extract_qty(item.get("qty", ""))
-    badge = item.get("badge", "").strip()
-    search = quote(name)
+CSV_FIELDS = ("includes", "name", "price", "reg", "qty", "badge", "img")
+DEFAULT_CSV_COLUMNS = (6, 7, 8, 17, 24, 25, 26)
+CSV_SECTION_NAMES = {
+    "living room": "living room",
+    "bedroom": "bedroom",
+    "dinning room": "dining room",
+    "dining room": "dining room",
+    "recliner": "recliner",
+}
 
-    data_attrs = []
-    if reg:
-        data_attrs.append(f'data-reg="{reg}"')
-    if now:
-        data_attrs.append(f'data-now="{now}"')
-    if qty:
-        data_attrs.append(f'data-qty="{html.escape(str(qty))}"')
-    if badge:
-        data_attrs.append(f'data-badge="{html.escape(badge)}"')
-    data_attrs_str = " ".join(data_attrs)
 
-    includes_text = f"Includes: {html.escape(includes)}" if includes else ""
-    qty_text = f"Qty Left: {html.escape(str(qty))}" if qty else ""
+class CsvColumnError(ValueError):
+    pass
+
+
+class Item:
+    __slots__ = CSV_FIELDS + ("image",)
+
+    def __init__(self, includes="", name="", price="", reg="", qty="", badge="", img=""):
+        self.includes = includes
+        self.name = name
+        self.price = price
+        self.reg = reg
+        self.qty = qty
+        self.badge = badge
+        self.img = img
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __eq__(self, other):
+        if isinstance(other, (Item, dict)):
+            return all(self.get(key, "") == other.get(key, "") for key in CSV_FIELDS)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Item({', '.join(f'{key}={getattr(self, key)!r}' for key in CSV_FIELDS)})"
+
+
+def parse_column_map(spec):
+    columns = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        field, sep, column = part.partition("=")
+        field = field.strip().lower()
+        if not sep or field not in CSV_FIELDS or not column.strip():
+            raise CsvColumnError(f"Invalid CSV_COLUMNS entry: {part.strip()}")
+        column = column.strip()
+        columns[field] = int(column) if column.isdigit() else column
+    return columns
+
+
+def resolve_columns(column_map, header=None):
+    indices = list(DEFAULT_CSV_COLUMNS)
+    names = {}
+    if header is not None:
+        names = {cell.strip().lower(): i for i, cell in enumerate(header) if cell.strip()}
+    missing = []
+    for position, field in enumerate(CSV_FIELDS):
+        column = column_map.get(field)
+        if isinstance(column, int):
+            indices[position] = column
+        elif column is not None:
+            if column.lower() not in names:
+                missing.append(column)
+            else:
+                indices[position] = names[column.lower()]
+    if missing:
+        raise CsvColumnError(f"CSV header is missing columns: {', '.join(missing)}")
+    return tuple(indices)
+
+
+CSV_SAMPLE_LINES = 64
+
+
+class CsvFeed:
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.head = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.head
+        if line is None:
+            return next(self.lines)
+        self.head = None
+        return line
+
+
+def split_rows(lines):
+    feed = CsvFeed(lines)
+    reader = csv.reader(feed)
+    for line in feed.lines:
+        if '"' not in line:
+            yield line.rstrip("\r\n").split(",")
+            continue
+        feed.head = line
+        yield next(reader)
+
+
+def csv_rows(lines):
+    # Lines without a quote can be split on commas directly; quoted ones go
+    # through a shared csv.reader, which may pull further lines for a quoted
+    # newline. Exports that quote most lines are given to csv.reader outright.
+    lines = iter(lines)
+    head = list(itertools.islice(lines, CSV_SAMPLE_LINES))
+    if sum('"' in line for line in head) * 2 > len(head):
+        return csv.reader(itertools.chain(head, lines))
+    return split_rows(itertools.chain(head, lines))
+
+
+def iter_csv_sections(lines, columns=None):
+    column_map = parse_column_map(CSV_COLUMNS if columns is None else columns)
+    if CSV_PARSER == "legacy" and not column_map:
+        yield from iter_csv_sections_legacy(lines)
+        return
+    project = width = None
+    if not any(isinstance(column, str) for column in column_map.values()):
+        indices = resolve_columns(column_map)
+        project, width = operator.itemgetter(*indices), max(indices) + 1
+    sections = CSV_SECTION_NAMES
+    current = None
+    for row in csv_rows(lines):
+        if not row:
+            continue
+        first = row[0]
+        if first and len(first) < 40:
+            key = first.strip().lower()
+            if key in sections:
+                current = sections[key]
+                continue
+            if key == "new product":
+                continue
+        if not (first.strip() or "".join(row).strip()):
+            continue
+        if project is None:
+            indices = resolve_columns(column_map, row)
+            project, width = operator.itemgetter(*indices), max(indices) + 1
+            continue
+        if current is None:
+            continue
+        if len(row) < width:
+            row += [""] * (width - len(row))
+        yield current, Item(*map(str.strip, project(row)))
+
+
+def collect_sections(pairs):
+    sections = {key: [] for key in SECTION_FILES.keys()}
+    for section, item in pairs:
+        sections[section].append(item)
+    return sections
+
+
+def parse_csv_sections(csv_text):
+    return collect_sections(iter_csv_sections(io.StringIO(csv_text)))
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class RequestBody(io.RawIOBase):
+    def __init__(self, rfile, length=None, limit=MAX_UPLOAD_BYTES):
+        self.rfile = rfile
+        self.chunked = length is None
+        self.remaining = 0 if self.chunked else length
+        self.limit = limit
+        self.total = 0
+        self.done = False
+
+    def readable(self):
+        return True
+
+    def next_chunk(self):
+        line = self.rfile.readline(1024)
+        size = line.split(b";", 1)[0].strip()
+        try:
+            self.remaining = int(size, 16)
+        except ValueError:
+            raise ValueError("Invalid chunk header") from None
+        if self.remaining == 0:
+            while self.rfile.readline(1024) not in {b"\r\n", b"\n", b""}:
+                pass
+            self.done = True
+
+    def readinto(self, buffer):
+        if self.done:
+            return 0
+        if self.remaining == 0:
+            if not self.chunked:
+                self.done = True
+                return 0
+            self.next_chunk()
+            if self.done:
+                return 0
+        view = memoryview(buffer)[: min(len(buffer), self.remaining)]
+        count = self.rfile.readinto(view)
+        if not count:
+            raise ValueError("Truncated request body")
+        self.remaining -= count
+        self.total += count
+        if self.total > self.limit:
+            raise UploadTooLarge(f"Body exceeds {self.limit} bytes")
+        if self.chunked and self.remaining == 0:
+            self.rfile.readline(1024)
+        return count
+
+
+class Template:
+    SLOT_RE = re.compile(r"\{(\w+)\}")
+
+    def __init__(self, source):
+        parts = self.SLOT_RE.split(source.strip())
+        self.statics = parts[0::2]
+        self.slots = parts[1::2]
+        self.pairs = list(zip(self.slots, self.statics[1:]))
+
+    def render_into(self, out, values):
+        out.append(self.statics[0])
+        for slot, static in self.pairs:
+            out.append(values[slot])
+            out.append(static)
+
+    def render(self, values):
+        out = []
+        self.render_into(out, values)
+        return "".join(out)
+
 
-    return f"""
-<table class="ms-card" {data_attrs_str} role="presentation" width="100%" cellspacing="0" cellpadding="0" style="border: 1px solid #e5e7eb; border-radius: 12px; overflow: hidden;">
+@functools.lru_cache(maxsize=4096)
+def escape(value):
+    return html.escape(value)
+
+
+CARD_TEMPLATE = Template("""
+<table class="ms-card" {data_attrs} role="presentation" width="100%" cellspacing="0" cellpadding="0" style="border: 1px solid #e5e7eb; border-radius: 12px; overflow: hidden;">
   <tbody>
     <tr>
       <td style="padding: 0;">
         <div style="position: relative;">
           <a href="/Product/SiteSearch?search={search}" style="text-decoration: none; color: inherit;">
-            <img src="{html.escape(img)}" alt="{html.escape(name)}" style="width: 100%; height: auto; display: block; border: 0;" />
+            <img src="{img_src}" alt="{name}"{img_attrs} style="width: 100%; height: auto; display: block; border: 0;" />
           </a>
-          <div class="ms-badge" style="position: absolute; top: 10px; left: 10px; background: #111827; color: #fff; font-weight: 900; border-radius: 999px; padding: 6px 10px; font-size: 12px; letter-spacing: .04em;">Clearance</div>
-          <div class="ms-offbadge" style="position: absolute; top: 10px; right: 10px; background: #b45309; color: #fff; font-weight: 900; border-radius: 999px; padding: 8px 14px; font-size: 14px; letter-spacing: .04em; box-shadow: 0 6px 14px rgba(0,0,0,.18);"></div>
-          <div style="position: absolute; left: 0; bottom: 0; background: #ffffff; color: #111827; font-weight: 900; font-size: 14px; padding: 6px 10px; border-top-right-radius: 8px;">{html.escape(name)}</div>
+          <div class="ms-badge" style="position: absolute; top: 10px; left: 10px; background: #111827; color: #fff; font-weight: 900; border-radius: 999px; padding: 6px 10px; font-size: 12px; letter-spacing: .04em;">{badge_text}</div>
+          <div class="ms-offbadge" style="position: absolute; top: 10px; right: 10px; background: #b45309; color: #fff; font-weight: 900; border-radius: 999px; padding: 8px 14px; font-size: 14px; letter-spacing: .04em; box-shadow: 0 6px 14px rgba(0,0,0,.18); display: {off_display};">{off_text}</div>
+          <div style="position: absolute; left: 0; bottom: 0; background: #ffffff; color: #111827; font-weight: 900; font-size: 14px; padding: 6px 10px; border-top-right-radius: 8px;">{name}</div>
         </div>
       </td>
     </tr>
@@ -381,8 +1996,8 @@ def card_html(item):
               <td valign="top" style="padding-right: 10px;">
                 <div style="color: #6b7280; font-size: 12px;">{includes_text}</div>
                 <div style="margin-top: 8px; display: flex; align-items: center; gap: 10px; flex-wrap: wrap;">
-                  <div class="ms-nowline" style="font-weight: 900; font-size: 13px; color: #111827;"></div>
-                  <div style="color: #374151; font-size: 13px;">Was <span class="ms-regline" style="text-decoration: line-through;"></span></div>
+                  <div class="ms-nowline" style="font-weight: 900; font-size: 13px; color: #111827;">{now_text}</div>
+                  <div style="color: #374151; font-size: 13px;">Was <span class="ms-regline" style="text-decoration: line-through;">{reg_text}</span></div>
                 </div>
               </td>
               <td valign="top" style="text-align: right;">
@@ -396,29 +2011,119 @@ def card_html(item):
     </tr>
   </tbody>
 </table>
-""".strip()
+""")
 
-
-def build_cards_table(items):
-    rows = []
-    for i in range(0, len(items), 2):
-        left = card_html(items[i])
-        right = card_html(items[i + 1]) if i + 1 < len(items) else ""
-        right_cell = right or ""
-        rows.append(f"""
+CARDS_ROW_TEMPLATE = Template("""
 <tr>
   <td width="50%" valign="top" style="padding: 8px;">{left}</td>
-  <td width="50%" valign="top" style="padding: 8px;">{right_cell}</td>
+  <td width="50%" valign="top" style="padding: 8px;">{right}</td>
 </tr>
-""".strip())
-    tbody = "\n".join(rows)
-    return f"""
+""")
+
+CARDS_TABLE_TEMPLATE = Template("""
 <table role="presentation" width="100%" cellspacing="0" cellpadding="0" style="margin: 6px 0;">
   <tbody>
-{tbody}
+{rows}
   </tbody>
 </table>
-""".strip()
+""")
+
+
+def format_money(amount):
+    return f"${amount:,}"
+
+
+def card_display(now, reg, qty, badge):
+    now = int(now) if now else 0
+    reg = int(reg) if reg else 0
+    off = reg - now if reg > 0 and now > 0 and reg > now else 0
+    return {
+        "badge_text": escape(badge) if badge else ("Last Ones" if qty == "1" else "Clearance"),
+        "off_text": f"{format_money(off)} OFF" if off else "",
+        "off_display": "inline-block" if off else "none",
+        "now_text": f"Now {format_money(now)}" if now > 0 else "",
+        "reg_text": format_money(reg) if reg > 0 else "",
+    }
+
+
+LAZY_IMG_ATTRS = ' loading="lazy" decoding="async"'
+
+
+def card_image(image):
+    src, srcset, width, height = image
+    attrs = f' width="{width}" height="{height}"{LAZY_IMG_ATTRS}' if width and height else LAZY_IMG_ATTRS
+    if srcset:
+        attrs = f' srcset="{escape(srcset)}" sizes="{escape(IMAGE_SIZES)}"{attrs}'
+    return escape(src), attrs
+
+
+def card_values(item):
+    name = item.get("name") or item.get("sku") or "Item"
+    includes = item.get("includes") or ""
+    img = item.get("img") or ""
+    now = extract_money(item.get("price", ""))
+    reg = extract_money(item.get("reg", ""))
+    qty = extract_qty(item.get("qty", ""))
+    badge = item.get("badge", "").strip()
+
+    data_attrs = []
+    if reg:
+        data_attrs.append(f'data-reg="{reg}"')
+    if now:
+        data_attrs.append(f'data-now="{now}"')
+    if qty:
+        data_attrs.append(f'data-qty="{escape(qty)}"')
+    if badge:
+        data_attrs.append(f'data-badge="{escape(badge)}"')
+    img_src = escape(img)
+    img_attrs = LAZY_IMG_ATTRS
+    image = item.get("image")
+    if image:
+        src, img_attrs = card_image(image)
+        if src and src != img_src:
+            data_attrs.append(f'data-img="{img_src}"')
+            img_src = src
+
+    values = card_display(now, reg, qty, badge)
+    values.update({
+        "data_attrs": " ".join(data_attrs),
+        "search": quote(name),
+        "img_src": img_src,
+        "img_attrs": img_attrs,
+        "name": escape(name),
+        "includes_text": f"Includes: {escape(includes)}" if includes else "",
+        "qty_text": f"Qty Left: {escape(qty)}" if qty else "",
+    })
+    return values
+
+
+def card_html(item):
+    return CARD_TEMPLATE.render(card_values(item))
+
+
+def build_cards_table(items, cards=None):
+    out = [CARDS_TABLE_TEMPLATE.statics[0]]
+    row_open, row_middle, row_close = CARDS_ROW_TEMPLATE.statics
+    for i in range(0, len(items), 2):
+        if i:
+            out.append("\n")
+        out.append(row_open)
+        if cards and cards[i]:
+            out.append(cards[i])
+        else:
+            CARD_TEMPLATE.render_into(out, card_values(items[i]))
+        out.append(row_middle)
+        if i + 1 < len(items):
+            if cards and cards[i + 1]:
+                out.append(cards[i + 1])
+            else:
+                CARD_TEMPLATE.render_into(out, card_values(items[i + 1]))
+        out.append(row_close)
+    out.append(CARDS_TABLE_TEMPLATE.statics[1])
+    return "".join(out)
+
+
+LOGIC_SCRIPT_RE = re.compile(r"(<!-- Logic -->\s*)<script>(.*?)</script>", re.S)
 
 
 def replace_cards_section(content, new_table):
@@ -428,21 +2133,1299 @@ def replace_cards_section(content, new_table):
     logic = content.find("<!-- Logic -->", start)
     if logic == -1:
         return None
-    return content[: start + len("<!-- Cards -->")] + "\n" + new_table + "\n" + content[logic:]
+    tail = content[logic:]
+    if not KEEP_LOGIC_SCRIPT:
+        tail = LOGIC_SCRIPT_RE.sub(r"\1", tail, count=1)
+    return content[: start + len("<!-- Cards -->")] + "\n" + new_table + "\n" + tail
+
+
+CARD_RE = re.compile(r'<table class="ms-card".*?\n</table>', re.S)
+CARD_DATA_RE = re.compile(r'\sdata-(reg|now|qty|badge|img)="([^"]*)"')
+CARD_IMG_RE = re.compile(r'<img src="([^"]*)" alt="([^"]*)"([^>]*)>')
+CARD_IMG_ATTR_RE = re.compile(r'\s(srcset|width|height)="([^"]*)"')
+CARD_INCLUDES_RE = re.compile(r'<div style="color: #6b7280; font-size: 12px;">(?:Includes: )?(.*?)</div>', re.S)
+
+
+def card_fields(item):
+    return (
+        item.get("name") or item.get("sku") or "Item",
+        item.get("includes") or "",
+        item.get("img") or "",
+        extract_money(item.get("price", "")),
+        extract_money(item.get("reg", "")),
+        extract_qty(item.get("qty", "")),
+        item.get("badge", "").strip(),
+        tuple(item.get("image") or ()),
+    )
+
+
+def fields_item(fields):
+    name, includes, img, now, reg, qty, badge, image = fields
+    return {
+        "image": image,
+        "includes": includes,
+        "name": name,
+        "price": f"${now}" if now else "",
+        "reg": f"${reg}" if reg else "",
+        "qty": qty,
+        "badge": badge,
+        "img": img,
+    }
+
+
+def parse_card(markup):
+    head = markup[: markup.find(">") + 1]
+    data = {key: html.unescape(value) for key, value in CARD_DATA_RE.findall(head)}
+    img = CARD_IMG_RE.search(markup)
+    includes = CARD_INCLUDES_RE.search(markup)
+    if img is None or includes is None:
+        return None
+    src = html.unescape(img.group(1))
+    attrs = {key: html.unescape(value) for key, value in CARD_IMG_ATTR_RE.findall(img.group(3))}
+    image = ()
+    if attrs.get("width") or attrs.get("srcset"):
+        image = (src if "img" in data else "", attrs.get("srcset", ""), attrs.get("width", ""), attrs.get("height", ""))
+    return (
+        html.unescape(img.group(2)),
+        html.unescape(includes.group(1)),
+        data.get("img", src),
+        data.get("now", ""),
+        data.get("reg", ""),
+        data.get("qty", ""),
+        data.get("badge", ""),
+        image,
+    )
+
+
+def parse_cards_section(content):
+    start = content.find("<!-- Cards -->")
+    if start == -1:
+        return None
+    logic = content.find("<!-- Logic -->", start)
+    if logic == -1:
+        return None
+    region = content[start:logic]
+    cards = []
+    for match in CARD_RE.finditer(region):
+        fields = parse_card(match.group(0))
+        if fields is None:
+            return None
+        cards.append((fields, match.group(0)))
+    if len(cards) != region.count('class="ms-card"'):
+        return None
+    return cards
+
+
+def card_spans(content):
+    start = content.find("<!-- Cards -->")
+    logic = content.find("<!-- Logic -->", start) if start != -1 else -1
+    if logic == -1:
+        return []
+    spans = []
+    for match in CARD_RE.finditer(content, start, logic):
+        fields = parse_card(match.group(0))
+        if fields is not None:
+            spans.append((fields, match.start(), match.end()))
+    return spans
+
+
+def diff_cards(old_cards, items):
+    pool = {}
+    for fields, markup in old_cards:
+        pool.setdefault((fields[0], fields[2]), []).append((fields, markup))
+    new_fields = [card_fields(item) for item in items]
+    cards = []
+    added = []
+    changed = []
+    for fields in new_fields:
+        matches = pool.get((fields[0], fields[2]))
+        if not matches:
+            added.append(fields[0])
+            cards.append(None)
+            continue
+        old_fields, markup = matches.pop(0)
+        if old_fields == fields:
+            cards.append(markup)
+        else:
+            changed.append(fields[0])
+            cards.append(None)
+    removed = [fields[0] for matches in pool.values() for fields, _ in matches]
+    reused = [(fields, markup) for fields, markup in zip(new_fields, cards) if markup]
+    template_changed = bool(reused) and card_html(fields_item(reused[0][0])) != reused[0][1]
+    if template_changed:
+        cards = [None] * len(items)
+    diff = {
+        "added": added,
+        "removed": removed,
+        "changed": changed,
+        "unchanged": len(reused),
+        "reordered": not (added or removed or changed) and new_fields != [f for f, _ in old_cards],
+        "template_changed": template_changed,
+    }
+    return cards, diff
+
+
+PUBLISH_LOCK = threading.Lock()
+PUBLISH_TEMP_RE = re.compile(r"^\..+\.publish-[0-9a-f]{16}$")
+
+
+@contextmanager
+def publish_guard(root):
+    # PUBLISH_LOCK orders threads; the flock keeps another process (a cron
+    # --build into the same root) from recovering our staged files mid-publish.
+    with PUBLISH_LOCK:
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(root / ".publish.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+
+def fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_synced(path, data):
+    with open(path, "wb") as fh:
+        fh.write(data)
+        fh.flush()
+        os.fsync(fh.fileno())
+
+
+def stage_file(tmp, target, content):
+    write_synced(tmp, content.encode("utf-8"))
+    try:
+        os.chmod(tmp, stat.S_IMODE(os.stat(target).st_mode))
+    except OSError:
+        pass
+
+
+def publish_files(root, pages, scope="page"):
+    # All-or-nothing for writers and crash recovery: each page is swapped in
+    # whole, and after a crash the journal rolls the set forward. Readers do
+    # not take the guard, so one that lands between two renames can see some
+    # pages of the new upload and some of the old.
+    with publish_guard(root):
+        txid = os.urandom(8).hex()
+        staged = [(root / f".{filename}.publish-{txid}", root / filename) for filename in pages]
+        try:
+            if len(staged) > 1:
+                futures = [
+                    executor("write").submit(stage_file, tmp, target, content)
+                    for (tmp, target), content in zip(staged, pages.values())
+                ]
+                for future in futures:
+                    future.result()
+            else:
+                for (tmp, target), content in zip(staged, pages.values()):
+                    stage_file(tmp, target, content)
+            journal = root / f".publish-{txid}.journal"
+            entries = [[tmp.name, target.name] for tmp, target in staged]
+            write_synced(journal.with_name(journal.name + ".tmp"), json.dumps(entries).encode("utf-8"))
+            os.replace(journal.with_name(journal.name + ".tmp"), journal)
+            fsync_dir(root)
+        except BaseException:
+            for tmp, _ in staged:
+                tmp.unlink(missing_ok=True)
+            raise
+        for tmp, target in staged:
+            EVENTS.claim(target.name, file_stamp(os.stat(tmp)))
+        for tmp, target in staged:
+            os.replace(tmp, target)
+        fsync_dir(root)
+        journal.unlink()
+        fsync_dir(root)
+        for filename in pages:
+            EVENTS.announce(filename, scope)
+    if OPTIMIZE_PAGES:
+        write_optimized(root, pages)
+
+
+def recover_publishes(root):
+    with publish_guard(root):
+        recovered = 0
+        for journal in root.glob(".publish-*.journal"):
+            try:
+                entries = json.loads(journal.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                entries = []
+            for tmp_name, target_name in entries:
+                tmp = root / tmp_name
+                if tmp.exists():
+                    os.replace(tmp, root / target_name)
+                    recovered += 1
+            journal.unlink()
+        for leftover in root.glob(".publish-*.journal.tmp"):
+            leftover.unlink()
+        for entry in root.iterdir():
+            if PUBLISH_TEMP_RE.match(entry.name):
+                entry.unlink()
+        fsync_dir(root)
+    return recovered
+
+
+RAW_BLOCK_RE = re.compile(r"(<(script|style|pre|textarea)\b.*?</\2\s*>)", re.S | re.I)
+TABLE_GAP_RE = re.compile(r"(</?(?:table|thead|tbody|tfoot|tr|td|th)\b[^>]*>)\s+|\s+(?=</?(?:table|thead|tbody|tfoot|tr|td|th)\b)", re.I)
+TAG_GAP_RE = re.compile(r">\s+<")
+OPEN_TAG_RE = re.compile(r"<([a-zA-Z][a-zA-Z0-9]*)(\s[^<>]*?)?(/?)>")
+STYLE_ATTR_RE = re.compile(r'\sstyle="([^"]*)"')
+
+
+def optimized_dir(root):
+    configured = os.environ.get("OPTIMIZE_DIR")
+    return Path(configured) if configured else root / "dist"
+
+
+def collapse_whitespace(markup):
+    out = []
+    for index, part in enumerate(RAW_BLOCK_RE.split(markup)):
+        if index % 3 == 1:
+            out.append(part)
+        elif index % 3 == 0:
+            part = TABLE_GAP_RE.sub(lambda m: m.group(1) or "", part)
+            out.append(TAG_GAP_RE.sub("> <", part))
+    return "".join(out).strip()
+
+
+def hoistable_style(attrs, style):
+    return ' class="' not in attrs and "url(" not in style and "!important" not in style and "'" not in style
+
+
+def hoist_styles(markup):
+    counts = {}
+    for match in OPEN_TAG_RE.finditer(markup):
+        attrs = match.group(2) or ""
+        style = STYLE_ATTR_RE.search(attrs)
+        if style and hoistable_style(attrs, style.group(1)):
+            counts[style.group(1)] = counts.get(style.group(1), 0) + 1
+    classes = {}
+    for style, count in sorted(counts.items(), key=lambda kv: (-kv[1], kv[0])):
+        if count * (len(style) - 4) > len(style) + 24:
+            classes[style] = f"fs{len(classes):x}"
+    if not classes:
+        return markup
+
+    def replace(match):
+        attrs = match.group(2) or ""
+        style = STYLE_ATTR_RE.search(attrs)
+        if not style or style.group(1) not in classes or not hoistable_style(attrs, style.group(1)):
+            return match.group(0)
+        attrs = attrs[: style.start()] + f' class="{classes[style.group(1)]}"' + attrs[style.end():]
+        return f"<{match.group(1)}{attrs}{match.group(3)}>"
+
+    rules = []
+    for style, name in classes.items():
+        declarations = [d.strip() for d in style.split(";") if d.strip()]
+        rules.append(f".{name}{{" + ";".join(f"{d} !important" for d in declarations) + "}")
+    return "<style>" + "".join(rules) + "</style>" + OPEN_TAG_RE.sub(replace, markup)
+
+
+def optimize_page(content, asset_base=ASSET_BASE_URL):
+    assets = {}
+
+    def extract(match):
+        script = match.group(2).strip()
+        name = f"logic-{hashlib.sha256(script.encode('utf-8')).hexdigest()[:12]}.js"
+        assets[name] = script.encode("utf-8")
+        return f'{match.group(1)}<script src="{asset_base}/{name}" defer></script>'
+
+    content = LOGIC_SCRIPT_RE.sub(extract, content)
+    content = hoist_styles(collapse_whitespace(content))
+    return content, assets
+
+
+def store_assets(root, assets):
+    folder = optimized_dir(root) / "assets"
+    folder.mkdir(parents=True, exist_ok=True)
+    for name, data in assets.items():
+        asset = folder / name
+        if not asset.exists():
+            write_atomic(asset, data)
+
+
+def write_optimized(root, pages):
+    for filename, content in pages.items():
+        optimized, assets = optimize_page(content)
+        store_assets(root, assets)
+        write_atomic(optimized_dir(root) / filename, optimized.encode("utf-8"))
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def executor(kind):
+    with _executors_lock:
+        pool = _executors.get(kind)
+        if pool is None:
+            if kind == "process":
+                pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=RENDER_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            elif kind == "thread":
+                pool = concurrent.futures.ThreadPoolExecutor(RENDER_WORKERS, thread_name_prefix="render")
+            else:
+                pool = concurrent.futures.ThreadPoolExecutor(WRITE_WORKERS, thread_name_prefix="write")
+            _executors[kind] = pool
+        return pool
+
+
+def shutdown_executors():
+    with _executors_lock:
+        pools = list(_executors.values())
+        _executors.clear()
+    for pool in pools:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def fragment_dir(root):
+    configured = os.environ.get("FRAGMENT_DIR")
+    return Path(configured) if configured else root / ".fragments"
+
+
+def fragment_url(filename, name):
+    return f"{FRAGMENT_BASE_URL}/{quote(filename)}/{name}"
+
+
+def cards_page_size():
+    # Batches are fetched by the live site, so paginate only once
+    # FRAGMENT_BASE_URL says where .fragments is published.
+    if not FRAGMENT_BASE_URL:
+        return 0
+    return CARDS_PAGE_SIZE + CARDS_PAGE_SIZE % 2
+
+
+LOAD_MORE_TEMPLATE = Template("""
+<div class="fd-more" data-fd-manifest="{manifest}" style="margin: 12px 0; text-align: center;">
+  <button type="button" style="padding: 10px 18px; border-radius: 10px; border: 1px solid #e5e7eb; background: #ffffff; color: #111827; font-weight: 800; font-size: 14px; cursor: pointer;">Load more ({remaining})</button>
+</div>
+<script>
+(function () {
+  var more = document.currentScript.previousElementSibling;
+  var button = more.querySelector('button');
+  var queue = null;
+  var busy = false;
+  function next() {
+    if (busy || !queue) return;
+    var batch = queue.shift();
+    if (!batch) { more.remove(); return; }
+    busy = true;
+    fetch(batch.url).then(function (res) { return res.text(); }).then(function (html) {
+      more.insertAdjacentHTML('beforebegin', html);
+      busy = false;
+      if (!queue.length) more.remove();
+    }).catch(function () { queue.unshift(batch); busy = false; });
+  }
+  fetch(more.getAttribute('data-fd-manifest')).then(function (res) { return res.json(); }).then(function (manifest) {
+    queue = manifest.batches.slice();
+    button.addEventListener('click', next);
+    if (window.IntersectionObserver) {
+      new IntersectionObserver(function (entries) {
+        if (entries[0].isIntersecting) next();
+      }, { rootMargin: '600px' }).observe(more);
+    }
+  });
+})();
+</script>
+""")
+
+
+FRAGMENT_MANIFEST_RE = re.compile(r'data-fd-manifest="[^"]*/(manifest-[0-9a-f]{12}\.json)"')
+
+
+def page_manifest(root, filename, content):
+    match = FRAGMENT_MANIFEST_RE.search(content)
+    if match is None:
+        return None, None
+    try:
+        manifest = json.loads((fragment_dir(root) / filename / match.group(1)).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        manifest = None
+    return match.group(1), manifest if isinstance(manifest, dict) else None
+
+
+def load_batches(root, filename, content):
+    name, manifest = page_manifest(root, filename, content)
+    if name is None:
+        return ""
+    if manifest is None:
+        return None
+    folder = fragment_dir(root) / filename
+    parts = []
+    for batch in manifest.get("batches", []):
+        try:
+            parts.append((folder / batch["file"]).read_text(encoding="utf-8"))
+        except (OSError, KeyError, TypeError):
+            return None
+    return "".join(parts)
+
+
+def batch_names(root, filename, content):
+    name, manifest = page_manifest(root, filename, content)
+    if name is None:
+        return set()
+    batches = manifest.get("batches", []) if manifest else []
+    return {name} | {batch.get("file") for batch in batches if isinstance(batch, dict)}
+
+
+def batch_files(filename, tables):
+    files = []
+    entries = []
+    for index, (count, markup) in enumerate(tables, 1):
+        data = markup.encode("utf-8")
+        name = f"batch-{index}-{hashlib.sha256(data).hexdigest()[:12]}.html"
+        files.append((name, data))
+        entries.append({"index": index, "file": name, "url": fragment_url(filename, name), "count": count})
+    manifest = json.dumps({
+        "file": filename,
+        "page_size": cards_page_size(),
+        "total": cards_page_size() + sum(count for count, _ in tables),
+        "batches": entries,
+    }, indent=1).encode("utf-8")
+    name = f"manifest-{hashlib.sha256(manifest).hexdigest()[:12]}.json"
+    files.append((name, manifest))
+    return name, files
+
+
+def render_section(original, items, incremental, filename="", extra=""):
+    cards = None
+    diff = None
+    size = cards_page_size()
+    old_cards = parse_cards_section(original) if incremental and extra is not None else None
+    if old_cards is not None:
+        inline = len(old_cards)
+        old_cards += [(parse_card(match.group(0)), match.group(0)) for match in CARD_RE.finditer(extra)]
+        if any(fields is None for fields, _ in old_cards):
+            old_cards = None
+    if old_cards is not None:
+        cards, diff = diff_cards(old_cards, items)
+        expected_inline = min(len(items), size) if size else len(items)
+        if all(cards) and len(old_cards) == len(items) and not diff["reordered"] and inline == expected_inline:
+            return None, diff, True, None
+    if not size or len(items) <= size:
+        return replace_cards_section(original, build_cards_table(items, cards)), diff, False, []
+    tables = [
+        (len(items[start: start + size]), build_cards_table(items[start: start + size], cards[start: start + size] if cards else None))
+        for start in range(size, len(items), size)
+    ]
+    manifest, files = batch_files(filename, tables)
+    table = build_cards_table(items[:size], cards[:size] if cards else None)
+    table += LOAD_MORE_TEMPLATE.render({"manifest": escape(fragment_url(filename, manifest)), "remaining": str(len(items) - size)})
+    return replace_cards_section(original, table), diff, False, files
+
+
+def write_batches(root, filename, files):
+    # Every name carries a content hash, so these files are never replaced
+    # in place: nothing refers to them until the journaled page swap does.
+    if not files:
+        return set()
+    folder = fragment_dir(root) / filename
+    folder.mkdir(parents=True, exist_ok=True)
+    for name, data in files:
+        if not (folder / name).exists():
+            write_atomic(folder / name, data)
+    return {name for name, _ in files}
+
+
+def prune_batches(root, filename, keep):
+    folder = fragment_dir(root) / filename
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return
+    for name in names:
+        if name not in keep:
+            (folder / name).unlink(missing_ok=True)
+    if not keep:
+        try:
+            folder.rmdir()
+        except OSError:
+            pass
+
+
+def render_sections(jobs):
+    total = sum(len(job[1]) for job in jobs)
+    if (
+        RENDER_POOL not in {"process", "thread"}
+        or RENDER_WORKERS < 2
+        or len(jobs) < 2
+        or total < PARALLEL_RENDER_MIN_ITEMS
+    ):
+        return [render_section(*job) for job in jobs]
+    try:
+        futures = [executor(RENDER_POOL).submit(render_section, *job) for job in jobs]
+        return [future.result() for future in futures]
+    except concurrent.futures.process.BrokenProcessPool:
+        with _executors_lock:
+            _executors.pop(RENDER_POOL, None)
+        return [render_section(*job) for job in jobs]
+
+
+def publish_sections(sections, root=None, incremental=INCREMENTAL_UPLOADS, backup=True, skip_backup=()):
+    root = root or ROOT
+    versions = VERSIONS if VERSION_STORE and root == ROOT else None
+    updated = {}
+    updated_files = []
+    skipped = []
+    diffs = {}
+    ts = time.strftime("%Y%m%d-%H%M%S")
+    targets = [
+        (section, SECTION_FILES[section], items)
+        for section, items in sections.items()
+        if section in SECTION_FILES
+    ]
+
+    with ExitStack() as locks:
+        for filename in sorted({filename for _, filename, _ in targets}):
+            locks.enter_context(file_lock(filename))
+
+        if IMAGES.enabled and root == ROOT:
+            for _, _, items in targets:
+                IMAGES.prepare(items)
+
+        loaded = []
+        with timed("io"):
+            for section, filename, items in targets:
+                path = root / filename
+                if path.is_file():
+                    original = path.read_text(encoding="utf-8", errors="replace")
+                    loaded.append((section, filename, items, original, load_batches(root, filename, original) if incremental else ""))
+        with timed("render"):
+            results = render_sections([
+                (original, items, incremental, filename, extra)
+                for _, filename, items, original, extra in loaded
+            ])
+
+        originals = {}
+        pending = {}
+        batches = {}
+        for (section, filename, items, original, _), (replaced, diff, unchanged, page_batches) in zip(loaded, results):
+            if diff is not None:
+                diffs[section] = diff
+            if unchanged:
+                updated[section] = len(items)
+                skipped.append(section)
+                continue
+            if replaced is None:
+                continue
+            originals[filename] = original
+            pending[filename] = replaced
+            batches[filename] = page_batches
+            updated[section] = len(items)
+            updated_files.append(filename)
+
+        if pending:
+            with timed("io"):
+                for filename, original in originals.items() if backup else ():
+                    if filename in skip_backup:
+                        continue
+                    if versions is not None:
+                        versions.record(filename, original, "backup")
+                        continue
+                    backup_path = root / f"{filename}.bak-{ts}"
+                    counter = 1
+                    while backup_path.exists():
+                        backup_path = root / f"{filename}.bak-{ts}-{counter}"
+                        counter += 1
+                    backup_path.write_text(original, encoding="utf-8")
+                    if root == CATALOG.root:
+                        CATALOG.add(backup_path.name)
+                kept = {filename: write_batches(root, filename, page_batches) for filename, page_batches in batches.items()}
+                publish_files(root, pending, "cards")
+                for filename, keep in kept.items():
+                    prune_batches(root, filename, keep | batch_names(root, filename, originals[filename]))
+
+        if INVENTORY_STORE and root == ROOT and targets:
+            with timed("io"):
+                INVENTORY.replace_sections({section: items for section, _, items in targets})
+
+    return {"updated": updated, "files": updated_files, "skipped": skipped, "diff": diffs}
+
+
+class PatchError(ValueError):
+    pass
+
+
+def save_content(name, content):
+    raw = content.encode("utf-8")
+    if VERSION_STORE:
+        version = VERSIONS.record(name, content, "save")
+        return {"file": name, "version": version["id"], "hash": version["hash"]}
+    path = ROOT / name
+    ts = time.strftime("%Y%m%d-%H%M%S")
+    new_name = f"{path.stem}-{ts}{path.suffix}"
+    counter = 1
+    while (ROOT / new_name).exists():
+        new_name = f"{path.stem}-{ts}-{counter}{path.suffix}"
+        counter += 1
+    (ROOT / new_name).write_bytes(raw)
+    CATALOG.add(new_name)
+    return {"file": new_name, "hash": hashlib.sha256(raw).hexdigest()}
+
+
+def save_head(name):
+    page = ROOT / name
+    mtime = page.stat().st_mtime
+    if VERSION_STORE:
+        versions = VERSIONS.versions(name)
+        if versions and versions[0]["time"] >= mtime:
+            raw = VERSIONS.read_object(versions[0]["hash"])
+            return versions[0]["hash"], raw.decode("utf-8", errors="replace"), {"version": versions[0]["id"]}
+    else:
+        saved = [item for item in CATALOG.history(name) if item["kind"] == "version"]
+        if saved and saved[0]["mtime"] >= int(mtime):
+            raw = (ROOT / saved[0]["file"]).read_bytes()
+            return hashlib.sha256(raw).hexdigest(), raw.decode("utf-8", errors="replace"), {"head_file": saved[0]["file"]}
+    raw = page.read_bytes()
+    return hashlib.sha256(raw).hexdigest(), raw.decode("utf-8", errors="replace"), {}
+
+
+def card_edit_span(content, cards, edit):
+    name = str(edit.get("name", ""))
+    img = edit.get("img")
+    matches = [card for card in cards if card[0][0] == name and (img is None or card[0][2] == img)]
+    try:
+        fields, start, end = matches[int(edit.get("index", 0))]
+    except (IndexError, TypeError, ValueError):
+        raise PatchError(f"Card not found: {name}") from None
+    if "html" in edit:
+        markup = str(edit["html"])
+    else:
+        changes = edit.get("item")
+        if not isinstance(changes, dict) or any(key not in CSV_FIELDS for key in changes):
+            raise PatchError("Card edit needs an item with card fields")
+        item = fields_item(fields)
+        item.update({key: str(value) for key, value in changes.items()})
+        if item["img"] != fields[2]:
+            item["image"] = None
+            if IMAGES.enabled:
+                IMAGES.prepare([item])
+        markup = card_html(item)
+    offset = len(content[:start].encode("utf-8"))
+    return offset, offset + len(content[start:end].encode("utf-8")), markup.encode("utf-8")
+
+
+def apply_edits(content, edits):
+    raw = content.encode("utf-8")
+    cards = None
+    spans = []
+    for edit in edits:
+        if not isinstance(edit, dict):
+            raise PatchError("Invalid edit")
+        op = edit.get("op")
+        if op == "replace":
+            try:
+                start, end = int(edit["start"]), int(edit["end"])
+            except (KeyError, TypeError, ValueError):
+                raise PatchError("Replace edit needs start and end") from None
+            if not 0 <= start <= end <= len(raw):
+                raise PatchError("Edit range out of bounds")
+            spans.append((start, end, str(edit.get("text", "")).encode("utf-8")))
+        elif op == "card":
+            if cards is None:
+                cards = card_spans(content)
+            spans.append(card_edit_span(content, cards, edit))
+        else:
+            raise PatchError(f"Unknown edit op: {op}")
+    spans.sort(key=lambda span: (span[0], span[1]))
+    for previous, span in zip(spans, spans[1:]):
+        if span[0] < previous[1]:
+            raise PatchError("Edits overlap")
+    out = []
+    pos = 0
+    for start, end, text in spans:
+        out.append(raw[pos:start])
+        out.append(text)
+        pos = end
+    out.append(raw[pos:])
+    try:
+        return b"".join(out).decode("utf-8")
+    except UnicodeDecodeError:
+        raise PatchError("Edit splits a UTF-8 character") from None
+
+
+def index_entry():
+    with timed("io"):
+        stamp, changed_at = CATALOG.stamp()
+    entry = PAGE_CACHE.get(("/", ""), stamp)
+    if entry is None:
+        with timed("io"):
+            files = list_files()
+        with timed("render"):
+            body = render_index(files).encode("utf-8")
+            entry = CachedBody(body, "text/html; charset=utf-8", changed_at)
+        PAGE_CACHE.put(("/", ""), stamp, entry)
+    return entry
+
+
+def build_page_entry(route, name, content, mtime, optimized=False, fragment=""):
+    assets = {}
+    if optimized:
+        content, assets = optimize_page(content)
+    if route == "/raw":
+        entry = CachedBody(render_raw(content).encode("utf-8"), "text/plain; charset=utf-8", mtime)
+    elif fragment:
+        markup = render_fragment(content, fragment)
+        if markup is None:
+            return None
+        entry = CachedBody(markup.encode("utf-8"), "text/html; charset=utf-8", mtime)
+    else:
+        entry = CachedBody(render_wrapper(name, content).encode("utf-8"), "text/html; charset=utf-8", mtime)
+    # Previews keep their hoisted scripts in memory; only write_optimized
+    # writes dist/ at publish time.
+    entry.assets = {
+        asset_name: CachedBody(data, "text/javascript; charset=utf-8", mtime)
+        for asset_name, data in assets.items()
+    }
+    return entry
+
+
+READY = threading.Event()
+WARMUP_STATS = {}
+
+
+def snapshot_path(root):
+    configured = os.environ.get("SNAPSHOT_PATH")
+    return Path(configured) if configured else root / ".snapshot"
+
+
+def warm_page(name):
+    path = ROOT / name
+    st = path.stat()
+    raw = path.read_bytes()
+    entry = build_page_entry("/render", name, raw.decode("utf-8", errors="replace"), st.st_mtime)
+    entry.gzipped()
+    PAGE_CACHE.put(("/render", name), file_stamp(st), entry)
+    return hashlib.sha256(raw).hexdigest(), entry
+
+
+def write_snapshot(path=None):
+    path = path or snapshot_path(ROOT)
+    CATALOG.scan()
+    files = list_files()
+    pages = []
+    for name in files:
+        try:
+            digest, entry = warm_page(name)
+        except OSError:
+            continue
+        pages.append({"name": name, "sha256": digest, "body": entry.body, "gzip": entry.gzipped()})
+    index = index_entry()
+    data = {
+        "python": sys.version,
+        "files": files,
+        "index": {"body": index.body, "gzip": index.gzipped()},
+        "pages": pages,
+    }
+    write_atomic(path, marshal.dumps(data))
+    return len(pages)
+
+
+def load_snapshot(path=None):
+    path = path or snapshot_path(ROOT)
+    try:
+        data = marshal.loads(path.read_bytes())
+    except (OSError, EOFError, ValueError, TypeError):
+        return set()
+    if not isinstance(data, dict) or data.get("python") != sys.version:
+        return set()
+    loaded = set()
+    for page in data.get("pages", []):
+        page_path = ROOT / page["name"]
+        try:
+            st = page_path.stat()
+            raw = page_path.read_bytes()
+        except OSError:
+            continue
+        if hashlib.sha256(raw).hexdigest() != page["sha256"]:
+            continue
+        entry = CachedBody(page["body"], "text/html; charset=utf-8", st.st_mtime)
+        entry._gzipped = page["gzip"]
+        PAGE_CACHE.put(("/render", page["name"]), file_stamp(st), entry)
+        loaded.add(page["name"])
+    if data.get("files") == list_files():
+        stamp, changed_at = CATALOG.stamp()
+        entry = CachedBody(data["index"]["body"], "text/html; charset=utf-8", changed_at)
+        entry._gzipped = data["index"]["gzip"]
+        PAGE_CACHE.put(("/", ""), stamp, entry)
+        loaded.add("/")
+    return loaded
+
+
+def warm_up():
+    start = time.perf_counter()
+    try:
+        loaded = load_snapshot()
+        pending = [name for name in list_files() if name not in loaded]
+        if len(pending) > 1:
+            results = list(executor("thread").map(safe_warm_page, pending))
+        else:
+            results = [safe_warm_page(name) for name in pending]
+        if "/" not in loaded:
+            index_entry().gzipped()
+        WARMUP_STATS.update({
+            "pages": len(loaded - {"/"}) + sum(results),
+            "from_snapshot": len(loaded - {"/"}),
+            "warmup_ms": round((time.perf_counter() - start) * 1000, 1),
+        })
+    finally:
+        READY.set()
+
+
+def safe_warm_page(name):
+    try:
+        warm_page(name)
+    except OSError:
+        return False
+    return True
+
+
+def build_manifest_path(root):
+    configured = os.environ.get("BUILD_MANIFEST")
+    return Path(configured) if configured else root / ".build-manifest.json"
+
+
+def build_version():
+    digest = hashlib.sha256(Path(__file__).read_bytes())
+    settings = (
+        cards_page_size(), FRAGMENT_BASE_URL, KEEP_LOGIC_SCRIPT, OPTIMIZE_PAGES, ASSET_BASE_URL,
+        IMAGES.enabled, IMAGE_WIDTHS, IMAGE_FORMAT, IMAGE_BASE_URL, IMAGE_SIZES,
+    )
+    digest.update(repr(settings).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def items_digest(items):
+    digest = hashlib.sha256()
+    for item in items:
+        digest.update("\x1f".join(item[key] for key in CSV_FIELDS).encode("utf-8"))
+        digest.update(b"\x1e")
+    return digest.hexdigest()
+
+
+def load_build_manifest(path, version):
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("version") != version:
+        return {}
+    return data.get("sections") or {}
+
+
+def build_is_current(root, entry, filename, digest):
+    if not entry or entry.get("file") != filename or entry.get("hash") != digest:
+        return False
+    try:
+        st = (root / filename).stat()
+    except OSError:
+        return False
+    if list(file_stamp(st)) != entry.get("stamp"):
+        return False
+    size = cards_page_size()
+    return not size or entry.get("items", 0) <= size or (fragment_dir(root) / filename / "manifest.json").is_file()
+
+
+def read_build_inputs(paths):
+    pairs = []
+    with timed("parse"):
+        for path in paths:
+            with open(path, encoding="utf-8-sig", errors="replace", newline="") as fh:
+                pairs.extend(iter_csv_sections(fh))
+    if not pairs:
+        raise CsvColumnError("No section rows found")
+    return pairs
+
+
+def prepare_build_target(root):
+    missing = [filename for filename in SECTION_FILES.values() if not (root / filename).is_file()]
+    if missing and (root == ROOT or any(not (ROOT / filename).is_file() for filename in missing)):
+        raise FileNotFoundError(f"Missing section page: {root / missing[0]}")
+    root.mkdir(parents=True, exist_ok=True)
+    for filename in missing:
+        write_atomic(root / filename, (ROOT / filename).read_bytes())
+    return set(missing)
+
+
+def build_pages(sections, root, incremental=INCREMENTAL_UPLOADS, force=False, backup=True, seeded=()):
+    recover_publishes(root)
+    version = build_version()
+    manifest_path = build_manifest_path(root)
+    previous = {} if force else load_build_manifest(manifest_path, version)
+    digests = {}
+    stale = {}
+    with timed("hash"):
+        for section, items in sections.items():
+            digests[section] = items_digest(items)
+            if not build_is_current(root, previous.get(section), SECTION_FILES[section], digests[section]):
+                stale[section] = items
+
+    built = []
+    if stale:
+        built = publish_sections(stale, root, incremental=incremental and not force, backup=backup, skip_backup=seeded)["files"]
+
+    entries = {}
+    report = {}
+    for section, items in sections.items():
+        filename = SECTION_FILES[section]
+        if section not in stale:
+            status = "cached"
+        elif filename in built:
+            status = "built"
+        else:
+            status = "unchanged"
+        entries[section] = {
+            "file": filename,
+            "items": len(items),
+            "hash": digests[section],
+            "stamp": list(file_stamp((root / filename).stat())),
+        }
+        report[section] = {"file": filename, "items": len(items), "status": status}
+    write_atomic(manifest_path, json.dumps({"version": version, "sections": entries}, indent=1).encode("utf-8"))
+    return {"version": version[:12], "built": built, "sections": report}
+
+
+def run_build(args):
+    root = Path(args.target).resolve()
+    summary = {"ok": False, "target": str(root), "inputs": args.build}
+    _request_state.phases = {}
+    start = time.perf_counter()
+    code = 2
+    try:
+        pairs = read_build_inputs([Path(path) for path in args.build])
+        summary["rows"] = len(pairs)
+        seeded = prepare_build_target(root)
+        code = 1
+        summary.update(build_pages(
+            collect_sections(pairs),
+            root,
+            force=args.force,
+            backup=not args.no_backup,
+            seeded=seeded,
+        ))
+        summary["ok"] = True
+        code = 0
+    except (OSError, ValueError, csv.Error) as err:
+        summary["error"] = str(err)
+    except Exception as err:
+        summary["error"] = f"{type(err).__name__}: {err}"
+        code = 1
+    finally:
+        shutdown_executors()
+    summary["phases_ms"] = {phase: round(spent * 1000, 1) for phase, spent in _request_state.phases.items()}
+    summary["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    print(json.dumps(summary, indent=1 if args.pretty else None))
+    return code
 
 
 class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_TIMEOUT
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        # Between keep-alive requests, hand the socket back to the server's
+        # idle selector instead of blocking a pool worker on the next read.
+        # Without one (SERVER_MODE=single) answer as HTTP/1.0 and close, so
+        # an idle browser connection can't hold the only thread.
+        self.parked = False
+        if getattr(self.server, "idle", None) is None:
+            self.protocol_version = "HTTP/1.0"
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            self.connection.settimeout(0)
+            try:
+                buffered = self.rfile.peek(1)
+            except OSError:
+                return
+            self.connection.settimeout(self.timeout)
+            if not buffered:
+                self.parked = True
+                return
+            self.handle_one_request()
+
+    def handle_one_request(self):
+        self.request_started = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self.request_started is not None:
+                self.finish_tracking()
+
+    def parse_request(self):
+        if not super().parse_request():
+            return False
+        self.request_started = time.perf_counter()
+        self.response_status = 0
+        self.response_bytes = 0
+        try:
+            self.request_bytes = int(self.headers.get("Content-Length", "0"))
+        except ValueError:
+            self.request_bytes = 0
+        _request_state.phases = {}
+        self.profile = None
+        if PROFILER.per_request():
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                self.profile = profile
+            except ValueError:
+                pass
+        return True
+
+    def finish_tracking(self):
+        if self.profile is not None:
+            self.profile.disable()
+            PROFILER.add(self.profile)
+            self.profile = None
+        phases = _request_state.phases
+        _request_state.phases = None
+        route = urlparse(self.path).path
+        if route not in METRIC_ROUTES:
+            route = "other"
+        elapsed = time.perf_counter() - self.request_started
+        METRICS.record(route, self.response_status, elapsed, self.request_bytes, self.response_bytes, phases)
+
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == "content-length":
+            self.response_bytes = int(value)
+        super().send_header(keyword, value)
+
     def do_GET(self):
         parsed = urlparse(self.path)
 
         if parsed.path == "/":
-            files = list_files()
-            body = render_index(files)
+            self.send_cached(index_entry())
+            return
+
+        if parsed.path == "/healthz":
+            status = {"status": "ok" if READY.is_set() else "warming", **WARMUP_STATS}
+            body = json.dumps(status).encode("utf-8")
+            self.send_response(200 if READY.is_set() else 503)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if parsed.path == "/events":
+            if not EVENTS.available():
+                self.send_error(503, "Too many event listeners")
+                return
             self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.send_header("Content-Length", str(len(body.encode("utf-8"))))
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("X-Accel-Buffering", "no")
             self.end_headers()
-            self.wfile.write(body.encode("utf-8"))
+            self.wfile.write(b"retry: 3000\n\n")
+            self.close_connection = True
+            EVENTS.attach(self.connection)
+            return
+
+        if parsed.path == "/api/history":
+            qs = parse_qs(parsed.query)
+            name = qs.get("file", [""])[0]
+            try:
+                page = max(1, int(qs.get("page", ["1"])[0]))
+                per_page = min(200, max(1, int(qs.get("per_page", [str(HISTORY_PAGE_SIZE)])[0])))
+            except ValueError:
+                self.send_error(400, "Invalid page")
+                return
+            if not name or "/" in name or "\\" in name:
+                self.send_error(400, "Invalid file")
+                return
+            with timed("io"):
+                items = CATALOG.history(name)
+                for version in VERSIONS.versions(name):
+                    items.append({
+                        "file": name,
+                        "version": version["id"],
+                        "kind": version["kind"],
+                        "ts": version["ts"],
+                        "size": version["size"],
+                        "mtime": int(version["time"]),
+                    })
+            items.sort(key=lambda item: item["mtime"], reverse=True)
+            start = (page - 1) * per_page
+            body = json.dumps({
+                "file": name,
+                "total": len(items),
+                "page": page,
+                "per_page": per_page,
+                "items": items[start: start + per_page],
+            }).encode("utf-8")
+            self.send_body(body, "application/json; charset=utf-8")
+            return
+
+        if parsed.path == "/api/items":
+            if not INVENTORY_STORE:
+                self.send_error(404, "Inventory store disabled")
+                return
+            qs = parse_qs(parsed.query)
+            sort = qs.get("sort", ["position"])[0]
+            if sort not in ITEM_SORTS:
+                self.send_error(400, "Invalid sort")
+                return
+            filters = []
+            try:
+                for param, column, op in ITEM_FILTERS:
+                    if qs.get(param, [""])[0] != "":
+                        filters.append((column, op, int(qs[param][0])))
+                page = max(1, int(qs.get("page", ["1"])[0]))
+                per_page = min(500, max(1, int(qs.get("per_page", [str(ITEMS_PAGE_SIZE)])[0])))
+            except ValueError:
+                self.send_error(400, "Invalid number")
+                return
+            if qs.get("badge", [""])[0]:
+                filters.append(("badge", "=", qs["badge"][0]))
+            with timed("io"):
+                total, items = INVENTORY.query(
+                    sections=[section for section in qs.get("section", []) if section],
+                    text=qs.get("q", [""])[0].strip(),
+                    filters=filters,
+                    sort=sort,
+                    limit=per_page,
+                    offset=(page - 1) * per_page,
+                )
+            body = json.dumps({"total": total, "page": page, "per_page": per_page, "items": items}).encode("utf-8")
+            self.send_body(body, "application/json; charset=utf-8")
+            return
+
+        if parsed.path in {"/api/versions", "/api/versions/diff"}:
+            qs = parse_qs(parsed.query)
+            name = qs.get("file", [""])[0]
+            if not self.valid_page_name(name):
+                self.send_error(400, "Invalid file")
+                return
+            if parsed.path == "/api/versions":
+                body = json.dumps({"file": name, "versions": VERSIONS.versions(name)}).encode("utf-8")
+                self.send_body(body, "application/json; charset=utf-8")
+                return
+            try:
+                a = int(qs.get("a", [""])[0])
+                b = qs.get("b", ["current"])[0]
+                b = b if b == "current" else int(b)
+            except ValueError:
+                self.send_error(400, "Invalid version")
+                return
+            with timed("render"):
+                text = VERSIONS.diff(name, a, b)
+            if text is None:
+                self.send_error(404, "Version not found")
+                return
+            self.send_body(text.encode("utf-8"), "text/plain; charset=utf-8")
+            return
+
+        if parsed.path.startswith("/assets/"):
+            asset_name = parsed.path[len("/assets/"):]
+            asset = optimized_dir(ROOT) / "assets" / asset_name
+            if "/" in asset_name or asset_name.startswith("."):
+                self.send_error(404, "File not found")
+                return
+            if not asset.is_file():
+                entry = PAGE_CACHE.get(("/assets", asset_name, "preview"), "preview")
+                if entry is None:
+                    self.send_error(404, "File not found")
+                    return
+                self.send_cached(entry, "public, max-age=31536000, immutable")
+                return
+            st = asset.stat()
+            entry = PAGE_CACHE.get(("/assets", asset_name), file_stamp(st))
+            if entry is None:
+                entry = CachedBody(asset.read_bytes(), "text/javascript; charset=utf-8", st.st_mtime)
+                PAGE_CACHE.put(("/assets", asset_name), file_stamp(st), entry)
+            self.send_cached(entry, "public, max-age=31536000, immutable")
+            return
+
+        if parsed.path.startswith("/fragments/"):
+            page_name, _, fragment_name = unquote(parsed.path[len("/fragments/"):]).partition("/")
+            fragment = fragment_dir(ROOT) / page_name / fragment_name
+            if (
+                not self.valid_page_name(page_name)
+                or not fragment_name
+                or "/" in fragment_name
+                or fragment_name.startswith(".")
+                or not fragment.is_file()
+            ):
+                self.send_error(404, "File not found")
+                return
+            st = fragment.stat()
+            key = ("/fragments", page_name, fragment_name)
+            entry = PAGE_CACHE.get(key, file_stamp(st))
+            if entry is None:
+                content_type = "application/json; charset=utf-8" if fragment_name.endswith(".json") else "text/html; charset=utf-8"
+                entry = CachedBody(fragment.read_bytes(), content_type, st.st_mtime)
+                PAGE_CACHE.put(key, file_stamp(st), entry)
+            self.send_cached(entry, "public, max-age=31536000, immutable")
+            return
+
+        if parsed.path.startswith("/img/"):
+            image_name = parsed.path[len("/img/"):]
+            image = image_dir(ROOT) / image_name
+            content_type = IMAGE_TYPES.get(Path(image_name).suffix)
+            if "/" in image_name or image_name.startswith(".") or content_type is None or not image.is_file():
+                self.send_error(404, "File not found")
+                return
+            st = image.stat()
+            entry = PAGE_CACHE.get(("/img", image_name), file_stamp(st))
+            if entry is None:
+                entry = CachedBody(image.read_bytes(), content_type, st.st_mtime)
+                PAGE_CACHE.put(("/img", image_name), file_stamp(st), entry)
+            self.send_cached(entry, "public, max-age=31536000, immutable")
+            return
+
+        if parsed.path == "/cache-stats":
+            body = json.dumps(PAGE_CACHE.stats()).encode("utf-8")
+            self.send_body(body, "application/json; charset=utf-8")
+            return
+
+        if parsed.path == "/metrics":
+            body = METRICS.render(PAGE_CACHE.stats()).encode("utf-8")
+            self.send_body(body, "text/plain; version=0.0.4; charset=utf-8")
+            return
+
+        if parsed.path == "/debug/profile":
+            if not ENABLE_PROFILING:
+                self.send_error(404, "Not found")
+                return
+            qs = parse_qs(parsed.query)
+            try:
+                seconds = float(qs.get("seconds", ["10"])[0])
+                limit = int(qs.get("limit", ["40"])[0])
+            except ValueError:
+                self.send_error(400, "Invalid seconds or limit")
+                return
+            seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+            sort_key = qs.get("sort", ["cumulative"])[0]
+            if sort_key not in pstats.Stats.sort_arg_dict_default:
+                self.send_error(400, "Invalid sort key")
+                return
+            if not PROFILER.start(seconds):
+                self.send_error(409, "A profile is already running")
+                return
+            time.sleep(seconds)
+            body = PROFILER.report(sort_key, limit).encode("utf-8")
+            self.send_body(body, "text/plain; charset=utf-8")
             return
 
         if parsed.path in {"/render", "/raw"}:
@@ -452,25 +3435,231 @@ class Handler(BaseHTTPRequestHandler):
                 self.send_error(400, "Invalid file")
                 return
             path = ROOT / name
-            if name in EXCLUDE or name.startswith(".") or not path.is_file():
+            st = None
+            if name not in EXCLUDE and not name.startswith("."):
+                try:
+                    st = path.stat()
+                except OSError:
+                    pass
+            if st is None or not stat.S_ISREG(st.st_mode):
                 self.send_error(404, "File not found")
                 return
-            content = path.read_text(encoding="utf-8", errors="replace")
-            if parsed.path == "/raw":
-                body = render_raw(content)
-                self.send_response(200)
-                self.send_header("Content-Type", "text/plain; charset=utf-8")
+            version = qs.get("version", [""])[0]
+            if version:
+                try:
+                    version_entry = VERSIONS.find(name, int(version))
+                except ValueError:
+                    version_entry = None
+                if version_entry is None:
+                    self.send_error(404, "Version not found")
+                    return
+                stamp = version_entry["hash"]
+                mtime = version_entry["time"]
+                key = (parsed.path, name, version_entry["id"])
             else:
-                body = render_wrapper(name, content)
-                self.send_response(200)
-                self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.send_header("Content-Length", str(len(body.encode("utf-8"))))
-            self.end_headers()
-            self.wfile.write(body.encode("utf-8"))
+                stamp = file_stamp(st)
+                mtime = st.st_mtime
+                key = (parsed.path, name)
+            optimized = qs.get("optimized", [""])[0] == "1"
+            if optimized:
+                key = key + ("optimized",)
+            fragment = qs.get("fragment", [""])[0] if parsed.path == "/render" else ""
+            if fragment == "manifest":
+                _, manifest = page_manifest(ROOT, name, path.read_text(encoding="utf-8", errors="replace"))
+                if manifest is None:
+                    self.send_error(404, "No card batches")
+                    return
+                self.send_body(json.dumps(manifest, indent=1).encode("utf-8"), "application/json; charset=utf-8")
+                return
+            if fragment and fragment not in {"cards", "page"}:
+                self.send_error(400, "Invalid fragment")
+                return
+            if fragment:
+                key = key + ("fragment", fragment)
+            if parsed.path == "/raw" and not version and not optimized:
+                download = path.name if qs.get("download", [""])[0] == "1" else ""
+                if "Range" in self.headers or st.st_size < GZIP_MIN_SIZE or not accepts_gzip(self.headers.get("Accept-Encoding", "")):
+                    self.send_file(path, "text/plain; charset=utf-8", download=bool(download))
+                    return
+                entry = PAGE_CACHE.get(key, stamp)
+                if entry is None:
+                    with timed("io"):
+                        entry = CachedBody(path.read_bytes(), "text/plain; charset=utf-8", mtime)
+                    PAGE_CACHE.put(key, stamp, entry)
+                self.send_cached(entry, download=download)
+                return
+            entry = PAGE_CACHE.get(key, stamp)
+            if entry is None:
+                with timed("io"):
+                    if version:
+                        content = VERSIONS.read_object(stamp).decode("utf-8", errors="replace")
+                    else:
+                        content = path.read_text(encoding="utf-8", errors="replace")
+                with timed("render"):
+                    entry = build_page_entry(parsed.path, name, content, mtime, optimized, fragment)
+                if entry is None:
+                    self.send_error(404, "No cards section")
+                    return
+                PAGE_CACHE.put(key, stamp, entry)
+            for asset_name, asset in entry.assets.items():
+                PAGE_CACHE.put(("/assets", asset_name, "preview"), "preview", asset)
+            self.send_cached(entry)
             return
 
         self.send_error(404, "Not found")
 
+    def valid_page_name(self, name):
+        return bool(name) and "/" not in name and "\\" not in name and name not in EXCLUDE and not name.startswith(".")
+
+    def read_json(self):
+        try:
+            length = int(self.headers.get("Content-Length", "0"))
+        except ValueError:
+            self.send_error(400, "Invalid length")
+            return None
+        if length > MAX_UPLOAD_BYTES:
+            self.send_error(413, "Upload too large")
+            return None
+        payload = self.rfile.read(length).decode("utf-8", errors="replace")
+        try:
+            data = json.loads(payload)
+        except json.JSONDecodeError:
+            self.send_error(400, "Invalid JSON")
+            return None
+        if not isinstance(data, dict):
+            self.send_error(400, "Invalid JSON")
+            return None
+        return data
+
+    def not_modified(self, entry):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return etag_matches(if_none_match, entry)
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+            return entry.mtime <= since
+        return False
+
+    def send_cached(self, entry, cache_control="no-cache", download=""):
+        body = entry.body
+        etag = entry.etag
+        encoding = None
+        if len(body) >= GZIP_MIN_SIZE and not entry.content_type.startswith("image/") and accepts_gzip(self.headers.get("Accept-Encoding", "")):
+            with timed("render"):
+                body = entry.gzipped()
+            etag = entry.gzip_etag
+            encoding = "gzip"
+        not_modified = self.not_modified(entry)
+        if not_modified:
+            self.send_response(304)
+        else:
+            self.send_response(200)
+            self.send_header("Content-Type", entry.content_type)
+            self.send_header("Content-Length", str(len(body)))
+            if encoding:
+                self.send_header("Content-Encoding", encoding)
+            if download:
+                self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(download)}")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", entry.last_modified)
+        self.send_header("Cache-Control", cache_control)
+        self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+        if not not_modified:
+            self.wfile.write(body)
+
+    def save_patch(self, name, data):
+        edits = data.get("edits")
+        base = str(data.get("base", ""))
+        if not isinstance(edits, list) or not base:
+            self.send_error(400, "Patch needs base and edits")
+            return
+        with file_lock(name):
+            with timed("io"):
+                head_hash, content, head = save_head(name)
+            if head_hash != base:
+                body = json.dumps({"ok": False, "error": "conflict", "head": head_hash, **head}).encode("utf-8")
+                self.send_response(409)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            try:
+                with timed("render"):
+                    patched = apply_edits(content, edits)
+            except PatchError as err:
+                self.send_error(422, str(err))
+                return
+            with timed("io"):
+                result = save_content(name, patched)
+        body = json.dumps({"ok": True, "base": base, **result}).encode("utf-8")
+        self.send_body(body, "application/json; charset=utf-8")
+
+    def send_file(self, path, content_type, download=False):
+        try:
+            fh = open(path, "rb")
+        except OSError:
+            self.send_error(404, "File not found")
+            return
+        with fh:
+            meta = FileBody(os.fstat(fh.fileno()))
+            if self.not_modified(meta):
+                self.send_response(304)
+                self.send_header("ETag", meta.etag)
+                self.send_header("Last-Modified", meta.last_modified)
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Vary", "Accept-Encoding")
+                self.end_headers()
+                return
+            byte_range = None
+            if_range = self.headers.get("If-Range")
+            if if_range is None or if_range.strip() in {meta.etag, meta.last_modified}:
+                byte_range = parse_range(self.headers.get("Range"), meta.size)
+            if byte_range is False:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{meta.size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            start, end = byte_range or (0, meta.size - 1)
+            self.send_response(206 if byte_range else 200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(end - start + 1))
+            if byte_range:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{meta.size}")
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", meta.etag)
+            self.send_header("Last-Modified", meta.last_modified)
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Vary", "Accept-Encoding")
+            if download:
+                self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(path.name)}")
+            self.end_headers()
+            with timed("io"):
+                self.copy_file(fh, start, end - start + 1)
+
+    def copy_file(self, fh, offset, count):
+        if count <= 0:
+            return
+        if hasattr(os, "sendfile"):
+            self.connection.sendfile(fh, offset, count)
+            return
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+            for pos in range(offset, offset + count, SEND_CHUNK):
+                self.wfile.write(view[pos: min(pos + SEND_CHUNK, offset + count)])
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def do_POST(self):
         parsed = urlparse(self.path)
 
@@ -488,6 +3677,9 @@ class Handler(BaseHTTPRequestHandler):
                 self.send_error(400, "Invalid JSON")
                 return
 
+            if not isinstance(data, dict):
+                self.send_error(400, "Invalid JSON")
+                return
             name = str(data.get("file", ""))
             html_content = str(data.get("html", ""))
             if not name or "/" in name or "\\" in name:
@@ -499,38 +3691,67 @@ class Handler(BaseHTTPRequestHandler):
                 self.send_error(404, "File not found")
                 return
 
-            ts = time.strftime("%Y%m%d-%H%M%S")
-            base = path.stem
-            suffix = path.suffix
-            new_name = f"{base}-{ts}{suffix}"
-            new_path = ROOT / new_name
-            counter = 1
-            while new_path.exists():
-                new_name = f"{base}-{ts}-{counter}{suffix}"
-                new_path = ROOT / new_name
-                counter += 1
+            if "edits" in data:
+                self.save_patch(name, data)
+                return
 
-            new_path.write_text(html_content, encoding="utf-8")
-            body = json.dumps({"ok": True, "file": new_name}).encode("utf-8")
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json; charset=utf-8")
-            self.send_header("Content-Length", str(len(body)))
-            self.end_headers()
-            self.wfile.write(body)
+            with file_lock(name):
+                with timed("io"):
+                    result = save_content(name, html_content)
+            body = json.dumps({"ok": True, **result}).encode("utf-8")
+            self.send_body(body, "application/json; charset=utf-8")
             return
 
-        if parsed.path == "/upload-csv":
+        if parsed.path == "/api/versions/restore":
+            data = self.read_json()
+            if data is None:
+                return
+            name = str(data.get("file", ""))
+            if not self.valid_page_name(name) or not (ROOT / name).is_file():
+                self.send_error(404, "File not found")
+                return
             try:
-                length = int(self.headers.get("Content-Length", "0"))
-            except ValueError:
-                self.send_error(400, "Invalid length")
+                version_id = int(data.get("version"))
+            except (TypeError, ValueError):
+                self.send_error(400, "Invalid version")
                 return
+            with timed("io"):
+                backup = VERSIONS.restore(name, version_id)
+            if backup is None:
+                self.send_error(404, "Version not found")
+                return
+            body = json.dumps({"ok": True, "file": name, "restored": version_id, "backup": backup["id"]}).encode("utf-8")
+            self.send_body(body, "application/json; charset=utf-8")
+            return
 
-            payload = self.rfile.read(length).decode("utf-8", errors="replace")
-            try:
-                data = json.loads(payload)
-            except json.JSONDecodeError:
-                self.send_error(400, "Invalid JSON")
+        if parsed.path == "/api/regenerate":
+            if not INVENTORY_STORE:
+                self.send_error(404, "Inventory store disabled")
+                return
+            data = self.read_json()
+            if data is None:
+                return
+            names = data.get("sections") or list(SECTION_FILES)
+            if (
+                not isinstance(names, list)
+                or not all(isinstance(name, str) for name in names)
+                or any(name not in SECTION_FILES for name in names)
+            ):
+                self.send_error(400, "Invalid sections")
+                return
+            with timed("io"):
+                sections = INVENTORY.sections(set(names))
+            if not sections:
+                self.send_error(404, "No stored items")
+                return
+            result = publish_sections(sections, incremental=INCREMENTAL_UPLOADS and not data.get("full"))
+            body = json.dumps({"ok": True, **result}).encode("utf-8")
+            self.send_body(body, "application/json; charset=utf-8")
+            return
+
+        if parsed.path == "/upload-csv":
+            data = self.read_json()
+            if data is None:
                 return
 
             csv_text = str(data.get("csv", ""))
@@ -538,51 +3759,264 @@ class Handler(BaseHTTPRequestHandler):
                 self.send_error(400, "Missing csv")
                 return
 
-            sections = parse_csv_sections(csv_text)
-            updated = {}
-            updated_files = []
-            ts = time.strftime("%Y%m%d-%H%M%S")
+            try:
+                with timed("parse"):
+                    sections = parse_csv_sections(csv_text)
+            except CsvColumnError as err:
+                self.send_error(400, str(err))
+                return
+            except csv.Error:
+                self.send_error(400, "Invalid CSV")
+                return
+            if not any(sections.values()):
+                self.send_error(400, "No section rows found")
+                return
+            incremental = INCREMENTAL_UPLOADS and "full" not in parse_qs(parsed.query)
+            result = publish_sections(sections, incremental=incremental)
+            body = json.dumps({"ok": True, **result}).encode("utf-8")
+            self.send_body(body, "application/json; charset=utf-8")
+            return
 
-            for section, items in sections.items():
-                filename = SECTION_FILES.get(section)
-                if not filename:
-                    continue
-                path = ROOT / filename
-                if not path.is_file():
-                    continue
-                original = path.read_text(encoding="utf-8", errors="replace")
-                table = build_cards_table(items)
-                replaced = replace_cards_section(original, table)
-                if replaced is None:
-                    continue
-                backup = ROOT / f"{filename}.bak-{ts}"
-                backup.write_text(original, encoding="utf-8")
-                path.write_text(replaced, encoding="utf-8")
-                updated[section] = len(items)
-                updated_files.append(filename)
+        if parsed.path == "/upload-csv-stream":
+            content_type = self.headers.get("Content-Type", "").split(";", 1)[0].strip().lower()
+            if content_type not in {"text/csv", "text/plain", "application/octet-stream"}:
+                self.send_error(415, "Expected text/csv")
+                return
+            if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+                length = None
+            else:
+                try:
+                    length = int(self.headers["Content-Length"])
+                except (KeyError, TypeError, ValueError):
+                    self.send_error(411, "Length required")
+                    return
+                if length > MAX_UPLOAD_BYTES:
+                    self.send_error(413, "Upload too large")
+                    return
 
-            body = json.dumps({"ok": True, "updated": updated, "files": updated_files}).encode("utf-8")
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json; charset=utf-8")
-            self.send_header("Content-Length", str(len(body)))
-            self.end_headers()
-            self.wfile.write(body)
+            stream = io.TextIOWrapper(
+                io.BufferedReader(RequestBody(self.rfile, length)),
+                encoding="utf-8-sig",
+                errors="replace",
+                newline="",
+            )
+            body_reader = stream.buffer.raw
+            try:
+                with timed("parse"):
+                    sections = collect_sections(iter_csv_sections(stream))
+            except UploadTooLarge:
+                self.send_error(413, "Upload too large")
+                return
+            except CsvColumnError as err:
+                self.send_error(400, str(err))
+                return
+            except (ValueError, csv.Error):
+                self.send_error(400, "Invalid upload body")
+                return
+            self.request_bytes = body_reader.total
+            if not any(sections.values()):
+                self.send_error(400, "No section rows found")
+                return
+
+            incremental = INCREMENTAL_UPLOADS and "full" not in parse_qs(parsed.query)
+            result = publish_sections(sections, incremental=incremental)
+            body = json.dumps({"ok": True, **result}).encode("utf-8")
+            self.send_body(body, "application/json; charset=utf-8")
             return
 
         self.send_error(404, "Not found")
         return
 
 
+class DashboardHTTPServer(HTTPServer):
+    def shutdown_request(self, request):
+        if EVENTS.owns(request):
+            return
+        super().shutdown_request(request)
+
+
+class IdleConnections:
+    def __init__(self, server, timeout=KEEPALIVE_TIMEOUT):
+        self.server = server
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.incoming = []
+        self.closed = False
+        self.selector = selectors.DefaultSelector()
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+        self.thread = threading.Thread(target=self.run, name="keep-alive", daemon=True)
+        self.thread.start()
+
+    def park(self, sock, client_address):
+        with self.lock:
+            if self.closed:
+                self.server.shutdown_request(sock)
+                return
+            self.incoming.append((sock, client_address))
+        self.wake()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        self.wake()
+
+    def wake(self):
+        try:
+            self.wake_w.send(b"\0")
+        except OSError:
+            pass
+
+    def run(self):
+        while True:
+            now = time.monotonic()
+            deadlines = [key.data[1] for key in self.selector.get_map().values() if key.data]
+            timeout = max(0.0, min(deadlines) - now) if deadlines else None
+            ready = []
+            for key, _ in self.selector.select(timeout):
+                if key.fileobj is self.wake_r:
+                    try:
+                        while self.wake_r.recv(4096):
+                            pass
+                    except OSError:
+                        pass
+                    continue
+                self.selector.unregister(key.fileobj)
+                ready.append((key.fileobj, key.data[0]))
+            with self.lock:
+                incoming, self.incoming = self.incoming, []
+                closed = self.closed
+            if closed:
+                for sock, _ in incoming + ready:
+                    self.server.shutdown_request(sock)
+                for key in list(self.selector.get_map().values()):
+                    if key.data:
+                        self.server.shutdown_request(key.fileobj)
+                self.selector.close()
+                return
+            now = time.monotonic()
+            for sock, client_address in incoming:
+                try:
+                    self.selector.register(sock, selectors.EVENT_READ, (client_address, now + self.timeout))
+                except (ValueError, OSError):
+                    self.server.shutdown_request(sock)
+            for key in list(self.selector.get_map().values()):
+                if key.data and key.data[1] <= now:
+                    self.selector.unregister(key.fileobj)
+                    self.server.shutdown_request(key.fileobj)
+            for sock, client_address in ready:
+                self.server.process_request(sock, client_address)
+
+
+class PooledHTTPServer(DashboardHTTPServer):
+    busy_response = (
+        b"HTTP/1.1 503 Service Unavailable\r\n"
+        b"Content-Type: text/plain; charset=utf-8\r\n"
+        b"Content-Length: 12\r\n"
+        b"Retry-After: 1\r\n"
+        b"Connection: close\r\n"
+        b"\r\n"
+        b"Server busy\n"
+    )
+
+    def __init__(self, server_address, handler_class, workers=WORKERS, queue_size=QUEUE_SIZE):
+        super().__init__(server_address, handler_class)
+        self.pending = queue.Queue(maxsize=queue_size)
+        self.workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self.work, name=f"dashboard-worker-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        self.idle = IdleConnections(self)
+
+    def finish_request(self, request, client_address):
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def work(self):
+        while True:
+            job = self.pending.get()
+            if job is None:
+                return
+            request, client_address = job
+            parked = False
+            try:
+                parked = self.finish_request(request, client_address).parked
+            except Exception:
+                self.handle_error(request, client_address)
+            if parked:
+                self.idle.park(request, client_address)
+            else:
+                self.shutdown_request(request)
+
+    def process_request(self, request, client_address):
+        try:
+            self.pending.put_nowait((request, client_address))
+        except queue.Full:
+            try:
+                request.sendall(self.busy_response)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.idle.close()
+        for _ in self.workers:
+            self.pending.put(None)
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="FDWEBSITE dashboard server.",
+        epilog="--build exits 0 on success, 1 if publishing failed and 2 on bad input; it prints a JSON summary either way.",
+    )
+    parser.add_argument("--snapshot", nargs="?", const="", metavar="PATH", help="pre-render every page into a startup snapshot and exit")
+    parser.add_argument("--build", nargs="+", metavar="CSV", help="regenerate the section pages from one or more CSV exports and exit")
+    parser.add_argument("--target", metavar="DIR", help="directory to build into (required with --build)")
+    parser.add_argument("--force", action="store_true", help="ignore the build manifest and rebuild every section")
+    parser.add_argument("--no-backup", action="store_true", help="do not keep backups of the pages a build replaces")
+    parser.add_argument("--pretty", action="store_true", help="indent the JSON build summary")
+    args = parser.parse_args()
+    if args.build:
+        if not args.target:
+            parser.error("--build needs an explicit --target; pass the web root itself to build into the live pages")
+        raise SystemExit(run_build(args))
+    if args.snapshot is not None:
+        target = Path(args.snapshot) if args.snapshot else snapshot_path(ROOT)
+        print(f"Wrote {write_snapshot(target)} pages to {target}")
+        shutdown_executors()
+        raise SystemExit(0)
+
     host = os.environ.get("HOST", "0.0.0.0")
-    try:
-        port = int(os.environ.get("PORT", "8000"))
-    except ValueError:
-        port = 8000
-    server = HTTPServer((host, port), Handler)
-    print(f"FDWEBSITE dashboard running at http://{host}:{port}")
+    port = env_int("PORT", 8000)
+    if os.environ.get("SERVER_MODE", "pooled") == "single":
+        server = DashboardHTTPServer((host, port), Handler)
+        mode = "single-threaded"
+    else:
+        server = PooledHTTPServer((host, port), Handler)
+        mode = f"{WORKERS} workers, queue {QUEUE_SIZE}"
+    recovered = recover_publishes(ROOT)
+    if recovered:
+        print(f"Recovered {recovered} files from an interrupted publish")
+    watch = CATALOG.start()
+    if VERSION_STORE and env_int("VERSION_IMPORT_LEGACY", 0):
+        print(f"Imported {VERSIONS.import_legacy(ROOT, CATALOG)} legacy version files into {VERSIONS.path}")
+    if IMAGES.enabled and not IMAGE_BASE_URL:
+        print("Image stage on without IMAGE_BASE_URL: card images keep their original src")
+    if CARDS_PAGE_SIZE and not FRAGMENT_BASE_URL:
+        print("CARDS_PAGE_SIZE ignored: set FRAGMENT_BASE_URL to where .fragments is served")
+    if WARMUP:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    else:
+        READY.set()
+    print(f"FDWEBSITE dashboard running at http://{host}:{port} ({mode}, catalog: {watch})")
     print("Press Ctrl+C to stop.")
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         pass
+    finally:
+        server.server_close()
+        shutdown_executors()